@@ -0,0 +1,617 @@
+"""news_summarizer 性能基准
+
+用法: python benchmarks.py [基准名称 ...] [--sizes N ...] [--fixtures 目录] [--json 结果文件] [--baseline 基线文件]
+                           [--workers N ...] [--backends 后端 ...] [--model-dir 目录]
+
+pipeline基准完全离线运行：录制好的（或按种子生成的）RSS和文章页面由本地桩服务器回放，
+摘要模型和spaCy换成极小的替身，只测流水线本身。录制真实数据: python benchmarks.py record-fixtures --fixtures 目录
+"""
+import argparse
+import hashlib
+import html
+import itertools
+import json
+import os
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+import feedparser
+
+import news_summarizer as ns
+
+
+def _timeit(func, repeat=3):
+    """多次运行取最短耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _random_word(rng, min_len=4, max_len=10):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(min_len, max_len)))
+
+
+def _synthetic_terms(rng, n):
+    """生成n个由1-3个单词组成的虚拟实体名称"""
+    return {' '.join(_random_word(rng).capitalize() for _ in range(rng.randint(1, 3))) for _ in range(n)}
+
+
+def _synthetic_texts(rng, terms, n_texts=200, n_words=60, mentions=3):
+    """生成混入若干实体名称的虚拟新闻文本"""
+    terms = list(terms)
+    texts = []
+    for _ in range(n_texts):
+        words = [_random_word(rng, 2, 8) for _ in range(n_words)]
+        for _ in range(mentions):
+            words.insert(rng.randrange(len(words)), rng.choice(terms))
+        texts.append(' '.join(words))
+    return texts
+
+
+def _legacy_match(text, companies, drugs, indications):
+    """原extract_entities中的逐词子串匹配"""
+    text_lower = text.lower()
+    return ([c for c in companies if c.lower() in text_lower],
+            [d for d in drugs if d.lower() in text_lower],
+            [i for i in indications if i.lower() in text_lower])
+
+
+def bench_entity_matcher(sizes=(200, 2000, 20000)):
+    """知识库实体匹配：逐词子串扫描 vs Aho–Corasick自动机"""
+    rng = random.Random(42)
+    print(f"{'词条数':>8} {'旧循环(ms/篇)':>14} {'自动机(ms/篇)':>14} {'构建(ms)':>10} {'加速比':>8}")
+    for size in sizes:
+        companies = _synthetic_terms(rng, size // 3)
+        drugs = _synthetic_terms(rng, size // 3)
+        indications = _synthetic_terms(rng, size - 2 * (size // 3))
+        texts = _synthetic_texts(rng, companies | drugs | indications)
+
+        build_time = _timeit(lambda: ns.build_entity_matcher(companies, drugs, indications), repeat=1)
+        matcher = ns.build_entity_matcher(companies, drugs, indications)
+
+        legacy_time = _timeit(lambda: [_legacy_match(t, companies, drugs, indications) for t in texts])
+        matcher_time = _timeit(lambda: [matcher.find(t) for t in texts])
+
+        print(f"{size:>8} {legacy_time / len(texts) * 1000:>14.3f} {matcher_time / len(texts) * 1000:>14.3f} "
+              f"{build_time * 1000:>10.1f} {legacy_time / matcher_time:>7.1f}x")
+
+
+def synthetic_news(n, seed=42, vocabulary_size=5000, cluster_size=3, mutation=0.2, inflection=0.0):
+    """生成n条虚拟新闻：每组1到cluster_size条互为改写的报道，日期分布在最近一周
+    
+    mutation为整词替换的比例，inflection为词形变化（加减词尾）的比例
+    """
+    rng = random.Random(seed)
+    vocabulary = [_random_word(rng, 3, 9) for _ in range(vocabulary_size)]
+    today = datetime.now()
+
+    def inflect(word):
+        return word[:-1] if word.endswith('s') else word + rng.choice(('s', 'ed', 'ing'))
+
+    def mutate(words):
+        words = [rng.choice(vocabulary) if rng.random() < mutation else word for word in words]
+        return [inflect(word) if rng.random() < inflection else word for word in words]
+
+    news = []
+    while len(news) < n:
+        title = [rng.choice(vocabulary) for _ in range(rng.randint(6, 12))]
+        summary = [rng.choice(vocabulary) for _ in range(rng.randint(30, 60))]
+        for _ in range(rng.randint(1, cluster_size)):
+            if len(news) >= n:
+                break
+            k = len(news)
+            news.append({
+                'title': ' '.join(mutate(title)).capitalize(),
+                'summary': ' '.join(mutate(summary)).capitalize() + '.',
+                'content': '',
+                'link': f'https://example.com/news/{k}',
+                'source': rng.choice(['FierceBiotech', 'BioSpace', 'stat']),
+                'date': (today - timedelta(days=rng.randint(0, 6))).strftime('%Y-%m-%d'),
+            })
+    return news
+
+
+# 词形变化只改词尾，字符级相似度仍然很高，按整词建索引时这类改写会漏掉
+SYNTHETIC_REWRITES = (
+    ('整词替换', {}),
+    ('词形变化', {'mutation': 0.05, 'inflection': 0.5}),
+)
+
+
+def _group_links(groups):
+    return sorted(tuple(sorted(source['link'] for source in group['sources'])) for group in groups)
+
+
+def bench_combine_similar_news(sizes=(1000, 10000, 50000), exact_max=1000):
+    """相似新闻合并：全量两两比较 vs MinHash LSH候选对 vs TF-IDF稀疏矩阵；语料分整词替换和词形变化两种改写"""
+    print(f"{'改写':<8} {'新闻数':>8} {'全量(s)':>10} {'LSH(s)':>10} {'分组一致':>8} {'TF-IDF(s)':>10}")
+    for (case, options), size in itertools.product(SYNTHETIC_REWRITES, sizes):
+        news = synthetic_news(size, **options)
+        lsh_groups = []
+        lsh_time = _timeit(lambda: lsh_groups.append(ns.combine_similar_news(news, use_lsh=True)), repeat=1)
+        tfidf_time = _timeit(lambda: ns.combine_similar_news(news, backend='tfidf'), repeat=1)
+        if size <= exact_max:
+            exact_groups = []
+            exact_time = _timeit(lambda: exact_groups.append(ns.combine_similar_news(news, use_lsh=False)), repeat=1)
+            same = _group_links(exact_groups[0]) == _group_links(lsh_groups[0])
+            print(f"{case:<8} {size:>8} {exact_time:>10.2f} {lsh_time:>10.2f} {str(same):>8} {tfidf_time:>10.2f}")
+        else:
+            print(f"{case:<8} {size:>8} {'-':>10} {lsh_time:>10.2f} {'-':>8} {tfidf_time:>10.2f}")
+
+
+def bench_kb_load(sizes=(1000, 10000, 100000), lookups=10000):
+    """知识库加载：逐行解析文本文件 vs 打开编译后的二进制文件，以及按名称查询类别"""
+    rng = random.Random(42)
+    print(f"{'词条数':>8} {'文本解析(ms)':>12} {'编译(ms)':>10} {'打开(ms)':>10} {'查询(us/次)':>12}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            kb_files = tuple(os.path.join(directory, name) for name in ns.KNOWLEDGE_BASE_FILES)
+            terms = list(_synthetic_terms(rng, size))
+            for i, path in enumerate(kb_files):
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write('\n'.join(terms[i::3]) + '\n')
+            artifact = os.path.join(directory, 'knowledge_base.kb')
+
+            text_time = _timeit(lambda: [ns.read_kb_names(path) for path in kb_files])
+            compile_time = _timeit(lambda: ns.compile_knowledge_base(kb_files, artifact), repeat=1)
+            open_time = _timeit(lambda: ns.KnowledgeBase.open(artifact))
+            kb = ns.KnowledgeBase.open(artifact)
+            queries = [rng.choice(terms) for _ in range(lookups)]
+            lookup_time = _timeit(lambda: [kb.categories(term) for term in queries])
+
+            print(f"{size:>8} {text_time * 1000:>12.2f} {compile_time * 1000:>10.2f} {open_time * 1000:>10.3f} "
+                  f"{lookup_time / lookups * 1e6:>12.2f}")
+
+
+# 录制的RSS中文章链接的主机部分替换成占位符，回放时换成桩服务器地址
+FIXTURE_BASE = 'http://fixture.invalid'
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _fixture_site(url):
+    """文章所属网站，决定回放路径，使ARTICLE_SELECTORS仍能按URL选中正文选择器"""
+    return next((site for site in ns.ARTICLE_SELECTORS if site in url), 'other')
+
+
+def _fixture_article_path(url):
+    return f"articles/{_fixture_site(url)}/{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}.html"
+
+
+def _write_fixture(directory, relative_path, data):
+    path = os.path.join(directory, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _write_manifest(directory, feeds):
+    with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump({'feeds': feeds}, f, ensure_ascii=False, indent=2)
+
+
+def record_fixtures(directory, rss_sources=None, client=None):
+    """录制线上RSS和其中每篇文章的页面，文章链接改写成占位地址后保存到directory"""
+    rss_sources = rss_sources or ns.RSS_SOURCES
+    client = client or ns.HttpClient()
+    feeds = {}
+    for source, rss_url in rss_sources.items():
+        xml = client.fetch(rss_url)
+        text = xml.decode('utf-8', errors='replace')
+        for entry in feedparser.parse(xml).entries:
+            link = getattr(entry, 'link', '')
+            if not link:
+                continue
+            try:
+                _write_fixture(directory, _fixture_article_path(link), client.fetch(link))
+            except Exception as e:
+                print(f"录制文章失败 {link}: {e}")
+                continue
+            text = text.replace(link, f"{FIXTURE_BASE}/{_fixture_article_path(link)}")
+        feeds[source] = f"feeds/{source}.xml"
+        _write_fixture(directory, feeds[source], text.encode('utf-8'))
+        print(f"录制了 {source}")
+    _write_manifest(directory, feeds)
+
+
+def _rss_xml(items):
+    entries = ''.join(
+        f"<item><title>{html.escape(item['title'])}</title><link>{item['link']}</link>"
+        f"<pubDate>{item['pub_date']}</pubDate><description>{html.escape(item['description'])}</description></item>"
+        for item in items)
+    return f'<?xml version="1.0"?><rss version="2.0"><channel><title>fixture</title>{entries}</channel></rss>'
+
+
+def write_synthetic_fixtures(directory, n, seed=42, paragraphs=6):
+    """按种子生成n篇新闻的RSS和文章页面，格式与录制的一致；stat的正文直接放在RSS里，不需要抓取"""
+    rng = random.Random(seed)
+    news = synthetic_news(n, seed=seed)
+    vocabulary = list({word for item in news[:200] for word in item['summary'].lower().split()})
+    containers = {'fiercebiotech': 'article-content', 'biospace': 'article__body'}
+    sources = {'FierceBiotech': 'fiercebiotech', 'BioSpace': 'biospace', 'stat': 'statnews'}
+    feeds = {source: [] for source in sources}
+
+    for k, item in enumerate(news):
+        source = list(sources)[k % len(sources)]
+        body = [item['summary']] + [' '.join(rng.choice(vocabulary) for _ in range(rng.randint(60, 120))) + '.'
+                                    for _ in range(paragraphs - 1)]
+        url = f"https://www.{sources[source]}.com/news/{k}"
+        pub_date = datetime.strptime(item['date'], '%Y-%m-%d').strftime('%a, %d %b %Y 10:00:00 GMT')
+        if source == 'stat':
+            description = ' '.join(body)
+        else:
+            description = item['summary'][:80]
+            container = containers[sources[source]]
+            page = f'<html><body><div class="{container}">' + ''.join(f"<p>{p}</p>" for p in body) + '</div></body></html>'
+            _write_fixture(directory, _fixture_article_path(url), page.encode('utf-8'))
+        feeds[source].append({
+            'title': item['title'],
+            'link': f"{FIXTURE_BASE}/{_fixture_article_path(url)}",
+            'pub_date': pub_date,
+            'description': description
+        })
+
+    manifest = {}
+    for source, items in feeds.items():
+        manifest[source] = f"feeds/{source}.xml"
+        _write_fixture(directory, manifest[source], _rss_xml(items).encode('utf-8'))
+    _write_manifest(directory, manifest)
+
+
+class _FixtureHTTPServer(ThreadingHTTPServer):
+    # 默认监听队列只有5，并发抓取时多出的连接要等1秒重传SYN，会污染延迟分位数
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FixtureServer:
+    """在本地端口回放fixtures目录中的RSS和文章页面"""
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = os.path.normpath(urlparse(self.path).path.lstrip('/'))
+                try:
+                    with open(os.path.join(server.directory, path), 'rb') as f:
+                        body = f.read()
+                except OSError:
+                    self.send_error(404)
+                    return
+                if path.startswith('feeds'):
+                    body = body.replace(FIXTURE_BASE.encode('utf-8'), server.base_url.encode('utf-8'))
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = _FixtureHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self._httpd.server_port}"
+
+    @property
+    def rss_sources(self):
+        return {source: f"{self.base_url}/{path}" for source, path in self.manifest['feeds'].items()}
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class StandInTokenizer:
+    """按空白切词的分词器，供长文切块使用"""
+
+    def __call__(self, texts, add_special_tokens=True, truncation=False, max_length=None):
+        split = [text.split()[:max_length] for text in texts] if isinstance(texts, list) else texts.split()[:max_length]
+        return {'input_ids': split}
+
+    def num_special_tokens_to_add(self):
+        return 0
+
+    def decode(self, input_ids, skip_special_tokens=True):
+        return ' '.join(input_ids)
+
+
+class StandInSummarizer:
+    """代替真实模型的摘要器：取正文开头的若干词，可模拟每篇的推理耗时，只测流水线本身"""
+
+    model_name = 'stand-in'
+    cache_key = 'stand-in'
+    workers = 1
+
+    def __init__(self, seconds_per_text=0.0):
+        self.seconds_per_text = seconds_per_text
+        self.batch_size = 8
+        self.max_input_tokens = 1024
+        self.tokenizer = StandInTokenizer()
+
+    def summarize(self, texts, max_length=150, min_length=30):
+        with ns.stage('summarize'):
+            if self.seconds_per_text:
+                time.sleep(self.seconds_per_text * len(texts))
+            return [' '.join(text.split()[:max_length // 2]) if text else None for text in texts]
+
+
+class _StandInDoc:
+    ents = ()
+
+
+class StandInNLP:
+    """代替spaCy模型，不识别任何命名实体；知识库匹配和研发代号识别照常运行"""
+
+    def __call__(self, text):
+        return _StandInDoc()
+
+    def pipe(self, texts, batch_size=64, n_process=1):
+        return (_StandInDoc() for _ in texts)
+
+
+def run_offline_pipeline(fixtures, summarizer=None):
+    """在临时目录中对fixtures跑一遍抓取→正文→摘要→存储→实体→分组→渲染，返回(文章数, 墙钟秒数, 指标快照)"""
+    saved = (os.getcwd(), ns.DB_PATH, ns._summarizer, ns._entity_context)
+    with tempfile.TemporaryDirectory() as workdir, FixtureServer(fixtures) as server:
+        os.chdir(workdir)
+        try:
+            ns.DB_PATH = os.path.join(workdir, 'news.db')
+            ns._summarizer = summarizer or StandInSummarizer()
+            # 知识库源文件复制到临时目录，编译结果也留在那里，不在仓库里生成文件
+            for path in ns.KNOWLEDGE_BASE_FILES:
+                if os.path.exists(os.path.join(REPO_DIR, path)):
+                    shutil.copy(os.path.join(REPO_DIR, path), path)
+            ns._entity_context = ns.EntityContext()
+            ns._entity_context._nlp = StandInNLP()
+            client = ns.HttpClient(max_workers=16, rate_per_host=1e9, burst=1e9)
+
+            ns.get_metrics().reset()
+            start = time.perf_counter()
+            found = ns.process_news(server.rss_sources, client=client)
+            # 词云渲染依赖matplotlib，这里只测分组和模板渲染
+            ns.generate_html(charts=('', '', ''), output=os.path.join(workdir, 'news_report.html'))
+            elapsed = time.perf_counter() - start
+            client.close()
+            return found, elapsed, ns.get_metrics().snapshot()
+        finally:
+            ns.close_db()
+            os.chdir(saved[0])
+            ns.DB_PATH, ns._summarizer, ns._entity_context = saved[1:]
+
+
+def _stage_rows(snapshot):
+    rows = {}
+    for stage in ns.PIPELINE_STAGES:
+        summary = snapshot['histograms'].get(f"stage.{stage}.seconds")
+        if summary:
+            rows[stage] = {key: summary[key] for key in ('count', 'sum', 'p50', 'p90', 'p99')}
+    return rows
+
+
+def bench_pipeline(sizes=(1000, 10000), fixtures=None):
+    """离线流水线：每个阶段的调用次数、累计耗时和单次延迟分位数，以及整体吞吐量"""
+    results = {}
+    runs = [(None, fixtures)] if fixtures else [(size, None) for size in sizes]
+    for size, directory in runs:
+        with tempfile.TemporaryDirectory() as generated:
+            if directory is None:
+                write_synthetic_fixtures(generated, size)
+                directory = generated
+            found, elapsed, snapshot = run_offline_pipeline(directory)
+
+        label = str(size or os.path.basename(os.path.normpath(fixtures)))
+        stages = _stage_rows(snapshot)
+        results[label] = {'articles': found, 'seconds': elapsed, 'articles_per_second': found / elapsed,
+                          'stages': stages, 'counters': snapshot['counters']}
+
+        print(f"\n{label}: {found} 篇文章，{elapsed:.2f}s，{found / elapsed:.1f} 篇/秒")
+        print(f"{'阶段':<10} {'次数':>8} {'累计(s)':>9} {'p50(ms)':>9} {'p90(ms)':>9} {'p99(ms)':>9}")
+        for stage, row in stages.items():
+            print(f"{stage:<10} {row['count']:>8} {row['sum']:>9.2f} {row['p50'] * 1000:>9.2f} "
+                  f"{row['p90'] * 1000:>9.2f} {row['p99'] * 1000:>9.2f}")
+    return results
+
+
+def find_regressions(results, baseline, tolerance=0.25):
+    """与基线比较各阶段的p50延迟和整体吞吐量，超过容差的列为回归"""
+    regressions = []
+    for label, run in results.items():
+        base = baseline.get(label)
+        if not base:
+            continue
+        if run['articles_per_second'] < base['articles_per_second'] * (1 - tolerance):
+            regressions.append(f"{label}: 吞吐量 {base['articles_per_second']:.1f} -> {run['articles_per_second']:.1f} 篇/秒")
+        for stage, row in run['stages'].items():
+            base_row = base['stages'].get(stage)
+            if base_row and row['p50'] > base_row['p50'] * (1 + tolerance):
+                regressions.append(f"{label}/{stage}: p50 {base_row['p50'] * 1000:.2f} -> {row['p50'] * 1000:.2f} ms")
+    return regressions
+
+
+def _worker_counts():
+    """1, 2, 4 ... 直到CPU核数"""
+    cpus = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 < cpus:
+        counts.append(counts[-1] * 2)
+    return tuple(counts) + ((cpus,) if cpus > 1 else ())
+
+
+def bench_summarizer_scaling(workers=None, n_texts=64, n_words=400):
+    """多进程摘要：1到N个工作进程时的吞吐量和加速比，不计模型加载时间；需要本地可用的摘要模型"""
+    rng = random.Random(42)
+    texts = [' '.join(_random_word(rng, 2, 9) for _ in range(n_words)).capitalize() + '.' for _ in range(n_texts)]
+    print(f"{'进程数':>6} {'每进程线程':>10} {'耗时(s)':>10} {'篇/秒':>8} {'加速比':>8}")
+    results = {}
+    for count in workers or _worker_counts():
+        summarizer = ns.SummarizerPool(count) if count > 1 else ns.Summarizer()
+        try:
+            # 每个进程先处理一篇，把模型加载排除在计时之外
+            summarizer.summarize(texts[:count])
+            elapsed = _timeit(lambda: summarizer.summarize(texts), repeat=1)
+        finally:
+            if count > 1:
+                summarizer.close()
+        results[count] = elapsed
+        threads = summarizer.threads if count > 1 else os.cpu_count() or 1
+        print(f"{count:>6} {threads:>10} {elapsed:>10.2f} {n_texts / elapsed:>8.2f} "
+              f"{results[min(results)] / elapsed:>7.2f}x")
+    return results
+
+
+def _rouge_l(candidate, reference):
+    """按词的最长公共子序列计算ROUGE-L F1"""
+    a, b = candidate.lower().split(), reference.lower().split()
+    if not a or not b:
+        return 0.0
+    previous = [0] * (len(b) + 1)
+    for word in a:
+        current = [0]
+        for j, other in enumerate(b):
+            current.append(previous[j] + 1 if word == other else max(previous[j + 1], current[j]))
+        previous = current
+    lcs = previous[-1]
+    if not lcs:
+        return 0.0
+    precision, recall = lcs / len(a), lcs / len(b)
+    return 2 * precision * recall / (precision + recall)
+
+
+def _sample_articles(n_texts, n_words=400):
+    """优先取数据库里已抓取的正文，没有时用合成文本"""
+    if os.path.exists(ns.DB_PATH):
+        rows = ns.get_db().execute("SELECT content FROM news WHERE content != '' ORDER BY date DESC LIMIT ?",
+                                   (n_texts,)).fetchall()
+        if rows:
+            return [content for content, in rows]
+    rng = random.Random(42)
+    return [' '.join(_random_word(rng, 2, 9) for _ in range(n_words)).capitalize() + '.' for _ in range(n_texts)]
+
+
+def bench_summarizer_backends(backends=None, n_texts=32, model_dir=None):
+    """摘要后端对比：模型加载时间、每篇延迟，以及与torch后端输出的ROUGE-L一致度"""
+    texts = _sample_articles(n_texts)
+    model_name = model_dir or ns.SUMMARIZER_MODEL_DIR or ns.SUMMARIZER_MODEL
+    print(f"{len(texts)} 篇文章，模型: {model_name}")
+    print(f"{'后端':<10} {'加载(s)':>8} {'ms/篇':>8} {'加速比':>8} {'ROUGE-L':>8}")
+    results = {}
+    reference = None
+    for backend in ('torch',) + tuple(b for b in backends or ns.SUMMARIZER_BACKENDS if b != 'torch'):
+        summarizer = ns.Summarizer(model_name=model_name, backend=backend)
+        try:
+            load_time = _timeit(lambda: summarizer.pipeline, repeat=1)
+        except ImportError as e:
+            print(f"{backend:<10} 缺少依赖: {e}")
+            continue
+        summaries = []
+        elapsed = _timeit(lambda: summaries.append(summarizer.summarize(texts)), repeat=1)
+        outputs = [summary or '' for summary in summaries[0]]
+        if reference is None:
+            reference = outputs
+        agreement = sum(map(_rouge_l, outputs, reference)) / len(outputs)
+        results[backend] = {'load_seconds': load_time, 'seconds_per_text': elapsed / len(texts),
+                            'rouge_l': agreement}
+        base = next(iter(results.values()))['seconds_per_text'] * len(texts)
+        print(f"{backend:<10} {load_time:>8.2f} {elapsed / len(texts) * 1000:>8.1f} "
+              f"{base / elapsed:>7.2f}x {agreement:>8.3f}")
+    return results
+
+
+HEAVY_MODULES = ('transformers', 'torch', 'spacy', 'sklearn', 'matplotlib', 'wordcloud',
+                 'yfinance', 'pandas', 'nltk', 'IPython', 'google.colab')
+
+
+def _run_python(code):
+    """在新的解释器中执行代码，返回耗时（秒）和标准输出"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.perf_counter() - start, result.stdout
+
+
+def bench_import_time(repeat=5):
+    """冷启动耗时：空解释器、import news_summarizer、CLI --help，以及导入后已加载的重量级依赖"""
+    check = f"import sys, news_summarizer; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    cases = [
+        ('python -c pass', 'pass'),
+        ('import news_summarizer', 'import news_summarizer'),
+        ('cli --help', "import news_summarizer as ns\ntry:\n    ns.cli(['--help'])\nexcept SystemExit:\n    pass"),
+    ]
+    print(f"{'场景':<24} {'最短(ms)':>10}")
+    for label, code in cases:
+        best = min(_run_python(code)[0] for _ in range(repeat))
+        print(f"{label:<24} {best * 1000:>10.1f}")
+    loaded = _run_python(check)[1].strip()
+    print(f"导入后已加载的重量级依赖: {loaded or '无'}")
+
+
+BENCHMARKS = {
+    'entity-matcher': bench_entity_matcher,
+    'combine-similar-news': bench_combine_similar_news,
+    'import-time': bench_import_time,
+    'kb-load': bench_kb_load,
+    'pipeline': bench_pipeline,
+    'summarizer-scaling': bench_summarizer_scaling,
+    'summarizer-backends': bench_summarizer_backends,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="news_summarizer 性能基准")
+    parser.add_argument('names', nargs='*', help=f"要运行的基准：{', '.join(BENCHMARKS)}；或 record-fixtures")
+    parser.add_argument('--sizes', type=int, nargs='+', help="合成语料的规模（篇数或词条数）")
+    parser.add_argument('--fixtures', help="pipeline基准回放的录制目录；record-fixtures的输出目录")
+    parser.add_argument('--json', help="把pipeline基准结果写入该文件")
+    parser.add_argument('--baseline', help="与之比较的pipeline基准结果文件，有回归时退出码为1")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="允许的相对退化幅度")
+    parser.add_argument('--workers', type=int, nargs='+', help="summarizer-scaling基准的摘要进程数，默认1到CPU核数")
+    parser.add_argument('--backends', nargs='+', choices=ns.SUMMARIZER_BACKENDS, help="summarizer-backends基准比较的后端")
+    parser.add_argument('--model-dir', help="从本地目录加载摘要模型（python news_summarizer.py export-model 目录）")
+    args = parser.parse_args()
+
+    if args.names == ['record-fixtures']:
+        record_fixtures(args.fixtures or 'benchmark_fixtures')
+        sys.exit(0)
+
+    results = {}
+    for name in args.names or list(BENCHMARKS):
+        print(f"\n== {name} ==")
+        kwargs = {'sizes': tuple(args.sizes)} if args.sizes and name in ('entity-matcher', 'combine-similar-news',
+                                                                         'kb-load', 'pipeline') else {}
+        if name == 'summarizer-scaling' and args.workers:
+            kwargs['workers'] = tuple(args.workers)
+        if name == 'summarizer-backends':
+            kwargs.update(backends=args.backends, model_dir=args.model_dir)
+        if name == 'pipeline' and args.fixtures:
+            kwargs['fixtures'] = args.fixtures
+        results[name] = BENCHMARKS[name](**kwargs)
+
+    if results.get('pipeline') is not None:
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(results['pipeline'], f, ensure_ascii=False, indent=2)
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                regressions = find_regressions(results['pipeline'], json.load(f), args.tolerance)
+            for line in regressions:
+                print(f"回归: {line}")
+            if regressions:
+                sys.exit(1)
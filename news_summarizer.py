@@ -1,33 +1,172 @@
+# transformers、spaCy、scikit-learn、matplotlib等重量级依赖只在用到的阶段才导入，
+# 只做报告或更新知识库时不必为加载它们付出几秒的启动时间
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
-from transformers import pipeline
 import sqlite3
-import matplotlib.pyplot as plt
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, DictLoader
 import webbrowser
 import os
 import re
-from collections import Counter
-import spacy
-from wordcloud import WordCloud
-from urllib.parse import urljoin
+from collections import Counter, defaultdict
+from urllib.parse import urljoin, urlparse
 from datetime import datetime, timedelta
 import pytz
 import time
+import threading
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
 import feedparser
-from IPython.display import HTML, display
-from google.colab import files
 import base64
+import cProfile
+import hashlib
+import json
+import logging
+import mmap
+import multiprocessing
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
 from difflib import SequenceMatcher
 from itertools import groupby
 from operator import itemgetter
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import DBSCAN
-import numpy as np
+from functools import partial
+from contextlib import contextmanager
 from io import BytesIO
-import pandas as pd
-import yfinance as yf
-import nltk
+
+logger = logging.getLogger('news_summarizer')
+
+# 可观测性：计数器、直方图、分阶段计时和可选的cProfile剖析
+PIPELINE_STAGES = ('fetch', 'parse', 'summarize', 'extract', 'group', 'render', 'store')
+RUN_REPORT_PATH = 'run_reports.jsonl'
+
+class Metrics:
+    """线程安全的计数器和直方图，计时也记成直方图（单位秒）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        self.histograms = defaultdict(list)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms[name].append(value)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @staticmethod
+    def _summarize(values):
+        values = sorted(values)
+        percentile = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+        return {
+            'count': len(values),
+            'sum': sum(values),
+            'min': values[0],
+            'max': values[-1],
+            'mean': sum(values) / len(values),
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'p99': percentile(0.99)
+        }
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {name: list(values) for name, values in self.histograms.items() if values}
+        return {
+            'counters': counters,
+            'histograms': {name: self._summarize(values) for name, values in sorted(histograms.items())}
+        }
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+_metrics = Metrics()
+
+def get_metrics():
+    """获取进程内共享的指标"""
+    return _metrics
+
+# 开启剖析的阶段共用各自的cProfile.Profile，多次进入同一阶段时结果累加；
+# 同一时刻只能有一个剖析器在运行，其他线程此时进入阶段只计时不剖析
+_profiles = {}
+_profile_lock = threading.Lock()
+
+def enable_profiling(stages):
+    """为指定阶段开启cProfile剖析，stages中的'all'表示所有阶段"""
+    if 'all' in stages:
+        stages = PIPELINE_STAGES
+    for name in stages:
+        _profiles.setdefault(name, cProfile.Profile())
+
+def dump_profiles(directory='profiles'):
+    """把各阶段的剖析结果写成 <阶段>.prof，可用pstats、snakeviz等工具查看"""
+    if not _profiles:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for name, profiler in _profiles.items():
+        # 本次运行没有进入过的阶段没有数据，写出来的文件pstats也读不了
+        if not profiler.getstats():
+            continue
+        path = os.path.join(directory, f"{name}.prof")
+        profiler.dump_stats(path)
+        logger.info(f"阶段 {name} 的剖析结果已写入 {path}")
+    _profiles.clear()
+
+@contextmanager
+def stage(name):
+    """流水线阶段：记录耗时到 stage.<名称>.seconds，该阶段开启剖析时同时运行cProfile"""
+    profiler = _profiles.get(name)
+    if profiler is not None and not _profile_lock.acquire(blocking=False):
+        get_metrics().incr(f"stage.{name}.unprofiled")
+        profiler = None
+    if profiler is not None:
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        get_metrics().observe(f"stage.{name}.seconds", time.perf_counter() - start)
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+
+def configure_logging(level='INFO'):
+    """配置日志级别和格式"""
+    logging.basicConfig(level=getattr(logging, str(level).upper(), logging.INFO),
+                        format='%(asctime)s %(levelname)s %(threadName)s %(message)s')
+
+def write_run_report(command, started_at, path=RUN_REPORT_PATH, **extra):
+    """把本次运行的计时和计数追加为一行JSON，便于长期跟踪趋势"""
+    finished_at = time.time()
+    report = {
+        'command': command,
+        'started_at': datetime.fromtimestamp(started_at).isoformat(),
+        'finished_at': datetime.fromtimestamp(finished_at).isoformat(),
+        'duration_seconds': finished_at - started_at,
+        **extra,
+        **get_metrics().snapshot()
+    }
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(report, ensure_ascii=False) + "\n")
+    logger.info(f"运行报告已写入 {path}")
+    return report
 
 # Step 1: Web Scraping
 def is_today(date_str, source):
@@ -46,7 +185,7 @@ def is_today(date_str, source):
         
         return date == today
     except Exception as e:
-        print(f"日期解析错误: {str(e)}")
+        logger.warning(f"日期解析错误: {str(e)}")
         return False
 
 def is_within_last_week(date_str, source):
@@ -64,32 +203,261 @@ def is_within_last_week(date_str, source):
         
         return week_ago <= date <= today
     except Exception as e:
-        print(f"日期解析错误: {str(e)}")
+        logger.warning(f"日期解析错误: {str(e)}")
         return True  # 如果无法解析日期，默认包含该新闻
 
+DB_PATH = 'news.db'
+
+# WAL模式下报告阶段可以在抓取阶段写入的同时读取
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -20000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+_db_local = threading.local()
+
+def get_db():
+    """获取当前线程复用的数据库连接，首次连接时设置连接参数"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None or _db_local.path != DB_PATH:
+        conn = sqlite3.connect(DB_PATH, timeout=5)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        _db_local.conn = conn
+        _db_local.path = DB_PATH
+    return conn
+
+def close_db():
+    """关闭当前线程的数据库连接"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _db_local.conn = None
+
+# 数据库结构迁移，按顺序执行，已执行的版本记录在PRAGMA user_version中
+SCHEMA_MIGRATIONS = [
+    # 1: 初始news表
+    [
+        '''CREATE TABLE IF NOT EXISTS news (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            link TEXT NOT NULL,
+            source TEXT NOT NULL,
+            content TEXT,
+            summary TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            date TEXT
+        )''',
+    ],
+    # 2: 按link去重，添加唯一键和内容哈希
+    [
+        "ALTER TABLE news ADD COLUMN content_hash TEXT",
+        "DELETE FROM news WHERE id NOT IN (SELECT MAX(id) FROM news GROUP BY link)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_news_link ON news(link)",
+    ],
+    # 3: 跨运行的摘要缓存和实体缓存
+    [
+        '''CREATE TABLE IF NOT EXISTS summary_cache (
+            content_hash TEXT NOT NULL,
+            model TEXT NOT NULL,
+            max_length INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (content_hash, model, max_length)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS entity_cache (
+            text_hash TEXT NOT NULL,
+            kb_version TEXT NOT NULL,
+            entities TEXT NOT NULL,
+            used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (text_hash, kb_version)
+        )''',
+    ],
+    # 4: 按日期清理、按日期和来源查询用的索引（link已有唯一索引）
+    [
+        "CREATE INDEX IF NOT EXISTS idx_news_date ON news(date)",
+        "CREATE INDEX IF NOT EXISTS idx_news_source ON news(source)",
+    ],
+    # 5: 标题、正文、摘要的FTS5全文索引，由触发器与news表保持同步
+    [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5("
+        "title, content, summary, content='news', content_rowid='id')",
+        '''CREATE TRIGGER IF NOT EXISTS news_fts_insert AFTER INSERT ON news BEGIN
+            INSERT INTO news_fts(rowid, title, content, summary)
+            VALUES (new.id, new.title, new.content, new.summary);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS news_fts_delete AFTER DELETE ON news BEGIN
+            INSERT INTO news_fts(news_fts, rowid, title, content, summary)
+            VALUES ('delete', old.id, old.title, old.content, old.summary);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS news_fts_update AFTER UPDATE ON news BEGIN
+            INSERT INTO news_fts(news_fts, rowid, title, content, summary)
+            VALUES ('delete', old.id, old.title, old.content, old.summary);
+            INSERT INTO news_fts(rowid, title, content, summary)
+            VALUES (new.id, new.title, new.content, new.summary);
+        END''',
+        "INSERT INTO news_fts(news_fts) VALUES ('rebuild')",
+    ],
+    # 6: 入库时提取的实体，规范化为实体表和文章-实体关联表
+    [
+        '''CREATE TABLE IF NOT EXISTS entity (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            UNIQUE (name, type)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS article_entity (
+            news_id INTEGER NOT NULL,
+            entity_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            offsets TEXT NOT NULL,
+            PRIMARY KEY (news_id, entity_id)
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_article_entity_entity ON article_entity(entity_id)",
+        # 记录文章的实体是用哪个知识库版本提取的，为空表示尚未提取
+        "ALTER TABLE news ADD COLUMN entity_kb_version TEXT",
+        '''CREATE TRIGGER IF NOT EXISTS news_entity_delete AFTER DELETE ON news BEGIN
+            DELETE FROM article_entity WHERE news_id = old.id;
+        END''',
+    ],
+    # 7: 全文索引只在标题、正文、摘要变化时更新，标记实体版本等其他列的UPDATE不再重写FTS
+    [
+        "DROP TRIGGER IF EXISTS news_fts_update",
+        '''CREATE TRIGGER news_fts_update AFTER UPDATE OF title, content, summary ON news BEGIN
+            INSERT INTO news_fts(news_fts, rowid, title, content, summary)
+            VALUES ('delete', old.id, old.title, old.content, old.summary);
+            INSERT INTO news_fts(rowid, title, content, summary)
+            VALUES (new.id, new.title, new.content, new.summary);
+        END''',
+    ],
+    # 8: 以前摘要失败时把标题存成摘要，这些文章被当成已完成而不再重试；有正文但摘要等于标题的清空，下次运行重新摘要
+    [
+        "UPDATE news SET summary = '', entity_kb_version = NULL "
+        "WHERE summary = title AND content IS NOT NULL AND content != ''",
+    ],
+]
+
 def init_database():
-    """初始化数据库"""
-    conn = sqlite3.connect('news.db')
-    c = conn.cursor()
-    
-    # 删除旧表（如果存在）
-    c.execute("DROP TABLE IF EXISTS news")
-    
-    # 创建新表，包含所有必要的字段
-    c.execute('''CREATE TABLE news (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        link TEXT NOT NULL,
-        source TEXT NOT NULL,
-        content TEXT,
-        summary TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        date TEXT
-    )''')
-    
-    conn.commit()
-    conn.close()
-    print("数据库初始化完成")
+    """初始化数据库，执行尚未应用的结构迁移（不再删除已有数据）"""
+    conn = get_db()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    
+    for target_version, statements in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        with conn:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {target_version}")
+        logger.info(f"数据库已迁移到版本 {target_version}")
+    
+    logger.info("数据库初始化完成")
+
+def news_content_hash(item):
+    """根据RSS中的标题和内容计算哈希，用于判断文章是否有变化"""
+    return text_hash(f"{item.get('title', '')}\n{item.get('content', '')}")
+
+def filter_unseen_news(news_list, require_summary=True):
+    """过滤掉已经处理过且内容没有变化的文章；require_summary为False时已抓取但未摘要的文章也算处理过"""
+    links = [item['link'] for item in news_list if item.get('link')]
+    summary_filter = "AND summary IS NOT NULL AND summary != ''" if require_summary else ""
+    seen = dict(_query_in_chunks(get_db().cursor(), f"""
+        SELECT link, content_hash FROM news
+        WHERE link IN ({{placeholders}}) {summary_filter}
+    """, links))
+    
+    return [item for item in news_list if seen.get(item.get('link')) != item['content_hash']]
+
+# 缓存条目超过该天数未被使用即淘汰，与news表的保留期一致
+CACHE_RETENTION_DAYS = 7
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def _query_in_chunks(c, sql, keys, params=(), chunk_size=500):
+    """分块执行带IN子句的查询，sql中用{placeholders}表示IN列表"""
+    keys = list(keys)
+    rows = []
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        c.execute(sql.format(placeholders=','.join('?' * len(chunk))), [*chunk, *params])
+        rows.extend(c.fetchall())
+    return rows
+
+def load_cached_summaries(content_hashes, model, max_length):
+    """按(内容哈希, 模型, max_length)读取摘要缓存，返回 {内容哈希: 摘要}"""
+    if not content_hashes:
+        return {}
+    try:
+        conn = get_db()
+        rows = _query_in_chunks(conn.cursor(), """
+            SELECT content_hash, summary FROM summary_cache
+            WHERE content_hash IN ({placeholders}) AND model = ? AND max_length = ?
+        """, content_hashes, (model, max_length))
+        cached = dict(rows)
+        with conn:
+            conn.executemany("""
+                UPDATE summary_cache SET used_at = CURRENT_TIMESTAMP
+                WHERE content_hash = ? AND model = ? AND max_length = ?
+            """, [(content_hash, model, max_length) for content_hash in cached])
+        return cached
+    except sqlite3.Error as e:
+        logger.warning(f"读取摘要缓存时出错: {str(e)}")
+        return {}
+
+def save_cached_summaries(summaries, model, max_length):
+    """写入摘要缓存，summaries为 {内容哈希: 摘要}"""
+    if not summaries:
+        return
+    try:
+        with get_db() as conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO summary_cache (content_hash, model, max_length, summary)
+                VALUES (?, ?, ?, ?)
+            """, [(content_hash, model, max_length, summary) for content_hash, summary in summaries.items()])
+    except sqlite3.Error as e:
+        logger.warning(f"写入摘要缓存时出错: {str(e)}")
+
+def load_cached_entities(text_hashes, kb_version):
+    """按(文本哈希, 知识库版本)读取实体缓存，返回 {文本哈希: 提及列表}"""
+    if not text_hashes:
+        return {}
+    try:
+        conn = get_db()
+        rows = _query_in_chunks(conn.cursor(), """
+            SELECT text_hash, entities FROM entity_cache
+            WHERE text_hash IN ({placeholders}) AND kb_version = ?
+        """, text_hashes, (kb_version,))
+        cached = {key: json.loads(entities) for key, entities in rows}
+        with conn:
+            conn.executemany("""
+                UPDATE entity_cache SET used_at = CURRENT_TIMESTAMP
+                WHERE text_hash = ? AND kb_version = ?
+            """, [(key, kb_version) for key in cached])
+        return cached
+    except sqlite3.Error as e:
+        logger.warning(f"读取实体缓存时出错: {str(e)}")
+        return {}
+
+def save_cached_entities(entities, kb_version):
+    """写入实体缓存，entities为 {文本哈希: 提及列表}"""
+    if not entities:
+        return
+    try:
+        with get_db() as conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO entity_cache (text_hash, kb_version, entities)
+                VALUES (?, ?, ?)
+            """, [(key, kb_version, json.dumps(value)) for key, value in entities.items()])
+    except sqlite3.Error as e:
+        logger.warning(f"写入实体缓存时出错: {str(e)}")
+
+def evict_caches(conn):
+    """淘汰超过保留期未使用的摘要和实体缓存"""
+    cutoff = f"-{CACHE_RETENTION_DAYS} days"
+    conn.execute("DELETE FROM summary_cache WHERE used_at < datetime('now', ?)", (cutoff,))
+    conn.execute("DELETE FROM entity_cache WHERE used_at < datetime('now', ?)", (cutoff,))
 
 def clean_html_title(html_title):
     """清理HTML标题"""
@@ -128,84 +496,83 @@ def parse_date(date_str):
         return datetime.now()
         
     except Exception as e:
-        print(f"日期解析错误: {str(e)} for date: {date_str}")
+        logger.warning(f"日期解析错误: {str(e)} for date: {date_str}")
         return datetime.now()
 
-def scrape_rss(rss_url, source):
-    """更新的RSS抓取函数"""
-    print(f"开始从RSS抓取: {rss_url}")
+def scrape_rss(rss_url, source, client=None):
+    """更新的RSS抓取函数，通过共享的HTTP客户端下载RSS"""
+    logger.info(f"开始从RSS抓取: {rss_url}")
+    client = client or get_http_client()
     
     try:
-        feed = feedparser.parse(rss_url)
-        news_list = []
-        week_ago = datetime.now() - timedelta(days=7)
-        
-        if source == 'BioSpace':
-            rss_url = 'https://www.biospace.com/all-news.rss'
-            feed = feedparser.parse(rss_url)
-        
-        print(f"找到 {len(feed.entries)} 条条目")
-        
-        for entry in feed.entries:
-            try:
-                # 清理标题
-                clean_title = clean_html_title(entry.title)
+        body = client.fetch(rss_url, ttl=FEED_CACHE_TTL)
+        with stage('parse'):
+            return _parse_feed(feedparser.parse(body), source)
+    except Exception as e:
+        logger.warning(f"RSS抓取错误: {str(e)}")
+        return []
+
+def _parse_feed(feed, source):
+    """从解析好的RSS中取出最近一周的新闻"""
+    news_list = []
+    week_ago = datetime.now() - timedelta(days=7)
+    
+    logger.info(f"找到 {len(feed.entries)} 条条目")
+    get_metrics().incr('feed.entries', len(feed.entries))
+    
+    for entry in feed.entries:
+        try:
+            # 清理标题
+            clean_title = clean_html_title(entry.title)
+            
+            # 获取发布日期
+            if hasattr(entry, 'published'):
+                pub_date = parse_date(entry.published)
+            elif hasattr(entry, 'updated'):
+                pub_date = parse_date(entry.updated)
+            else:
+                pub_date = datetime.now()
+            
+            # 检查是否在最近一周内
+            if pub_date.replace(tzinfo=None) >= week_ago:
+                # 获取文章内容
+                content = ''
+                if hasattr(entry, 'content'):
+                    content = entry.content[0].value
+                elif hasattr(entry, 'summary'):
+                    content = entry.summary
+                elif hasattr(entry, 'description'):
+                    content = entry.description
                 
-                # 获取发布日期
-                if hasattr(entry, 'published'):
-                    pub_date = parse_date(entry.published)
-                elif hasattr(entry, 'updated'):
-                    pub_date = parse_date(entry.updated)
-                else:
-                    pub_date = datetime.now()
+                # 清理HTML标签
+                if content:
+                    soup = BeautifulSoup(content, 'html.parser')
+                    content = soup.get_text(separator=' ', strip=True)
                 
-                # 检查是否在最近一周内
-                if pub_date.replace(tzinfo=None) >= week_ago:
-                    # 获取文章内容
-                    content = ''
-                    if hasattr(entry, 'content'):
-                        content = entry.content[0].value
-                    elif hasattr(entry, 'summary'):
-                        content = entry.summary
-                    elif hasattr(entry, 'description'):
-                        content = entry.description
-                    
-                    # 清理HTML标签
-                    if content:
-                        soup = BeautifulSoup(content, 'html.parser')
-                        content = soup.get_text(separator=' ', strip=True)
-                    
-                    # 获取链接
-                    link = entry.link if hasattr(entry, 'link') else ''
-                    
-                    news_item = {
-                        'title': clean_title,
-                        'link': link,
-                        'source': source,
-                        'date': pub_date.strftime('%Y-%m-%d'),
-                        'content': content,
-                        'summary': ''
-                    }
-                    
-                    # 打印调试信息
-                    print(f"\n找到文章:")
-                    print(f"标题: {clean_title}")
-                    print(f"日期: {news_item['date']}")
-                    print(f"链接: {link}")
-                    print(f"内容长度: {len(content)} 字符")
-                    
-                    news_list.append(news_item)
-            
-            except Exception as e:
-                print(f"处理RSS条目时出错: {str(e)}")
-                continue
+                # 获取链接
+                link = entry.link if hasattr(entry, 'link') else ''
+                
+                news_item = {
+                    'title': clean_title,
+                    'link': link,
+                    'source': source,
+                    'date': pub_date.strftime('%Y-%m-%d'),
+                    'content': content,
+                    'summary': ''
+                }
+                
+                # 调试信息
+                logger.debug("找到文章: 标题=%s 日期=%s 链接=%s 内容长度=%d",
+                             clean_title, news_item['date'], link, len(content))
+                
+                news_list.append(news_item)
         
-        print(f"\n成功从{source}的RSS获取 {len(news_list)} 条最近一周的新闻")
-        return news_list
+        except Exception as e:
+            logger.warning(f"处理RSS条目时出错: {str(e)}")
+            continue
     
-    except Exception as e:
-        print(f"RSS抓取错误: {str(e)}")
-        return []
+    logger.info(f"成功从{source}的RSS获取 {len(news_list)} 条最近一周的新闻")
+    return news_list
 
 def scrape_news(base_url):
     """根据不同来源使用不同的抓取方法"""
@@ -218,14 +585,14 @@ def scrape_news(base_url):
     }
     
     try:
-        print(f"\n尝试抓取: {base_url}")
+        logger.debug(f"尝试抓取: {base_url}")
         response = requests.get(base_url, headers=headers, timeout=15)
         response.raise_for_status()
         soup = BeautifulSoup(response.text, 'html.parser')
         news_list = []
         
         articles = soup.select('.article-card, .news-item')
-        print(f"BioSpace: 找到 {len(articles)} 个文章元素")
+        logger.debug(f"BioSpace: 找到 {len(articles)} 个文章元素")
         
         for article in articles:
             try:
@@ -245,297 +612,1480 @@ def scrape_news(base_url):
                         'date': date_str,
                         'content': ''
                     })
-                    print(f"找到文章: {title}")
+                    logger.debug("找到文章: %s", title)
             except Exception as e:
-                print(f"处理文章时出错: {str(e)}")
+                logger.warning(f"处理文章时出错: {str(e)}")
         
         return news_list
     
     except Exception as e:
-        print(f"抓取错误: {str(e)}")
+        logger.warning(f"抓取错误: {str(e)}")
         return []
 
-def get_article_content(url):
+# 按主机限速的共享HTTP客户端
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+class HostRateLimiter:
+    """按主机的令牌桶限速器：每个主机每秒补充rate个令牌，最多积累burst个"""
+
+    def __init__(self, rate=1.0, burst=2):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url):
+        """阻塞直到该URL所在主机有可用令牌"""
+        host = urlparse(url).netloc
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self._buckets[host] = (tokens - 1, now)
+                    return
+                self._buckets[host] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+# RSS需要及时更新，文章页面发布后基本不变
+FEED_CACHE_TTL = 15 * 60
+ARTICLE_CACHE_TTL = 7 * 24 * 3600
+
+class HttpCache:
+    """磁盘响应缓存：按URL建索引，正文按内容哈希存储，支持条件请求、TTL和按总大小的LRU淘汰
+
+    索引的访问时间、正文引用计数和大小在内存中维护，淘汰时不必重新扫描目录
+    """
+
+    # 超过上限后一次淘汰到上限的这个比例以下，避免之后每次写入都触发淘汰
+    EVICT_TO = 0.8
+
+    def __init__(self, directory='http_cache', ttl=3600, max_bytes=200 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.index_dir = os.path.join(directory, 'index')
+        self.blob_dir = os.path.join(directory, 'blobs')
+        os.makedirs(self.index_dir, exist_ok=True)
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """启动时扫描一次索引和正文，删除没有条目引用的正文（中断写入留下的.tmp文件不算在内）"""
+        self._entries = {}  # 索引文件路径 -> [访问时间, 正文哈希]
+        self._refs = Counter()
+        self._blob_sizes = {}
+        for name in os.listdir(self.index_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.index_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            self._entries[path] = [entry.get('accessed_at', 0), entry['body_hash']]
+            self._refs[entry['body_hash']] += 1
+        for name in os.listdir(self.blob_dir):
+            if name.endswith('.tmp'):
+                continue
+            if name in self._refs:
+                self._blob_sizes[name] = os.path.getsize(self._blob_path(name))
+            else:
+                self._remove_blob_file(name)
+        self._total_bytes = sum(self._blob_sizes.values())
+
+    def _index_path(self, url):
+        return os.path.join(self.index_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _blob_path(self, body_hash):
+        return os.path.join(self.blob_dir, body_hash)
+
+    def _write_entry(self, url, entry):
+        path = self._index_path(url)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def lookup(self, url):
+        """返回URL的缓存条目，不存在时返回None"""
+        try:
+            with open(self._index_path(url), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def is_fresh(self, entry, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() - entry['stored_at'] < ttl
+
+    def read_body(self, url, entry):
+        """读取缓存正文并更新访问时间，正文已被淘汰时返回None"""
+        try:
+            with open(self._blob_path(entry['body_hash']), 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            # 读取期间条目可能已被淘汰，这时不再写回索引
+            memo = self._entries.get(self._index_path(url))
+            if memo is not None and memo[1] == entry['body_hash']:
+                entry['accessed_at'] = memo[0] = time.time()
+                self._write_entry(url, entry)
+        return body
+
+    def revalidated(self, url, entry, headers):
+        """304响应后刷新条目的存储时间和校验信息"""
+        entry['stored_at'] = time.time()
+        entry['etag'] = headers.get('ETag') or entry.get('etag')
+        entry['last_modified'] = headers.get('Last-Modified') or entry.get('last_modified')
+        self._write_entry(url, entry)
+
+    def store(self, url, body, headers):
+        body_hash = hashlib.sha256(body).hexdigest()
+        blob_path = self._blob_path(body_hash)
+        now = time.time()
+        # 正文和索引条目在同一把锁内写入，淘汰不会看到还没有条目引用的新正文
+        with self._lock:
+            if body_hash not in self._blob_sizes:
+                tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(body)
+                os.replace(tmp_path, blob_path)
+                self._blob_sizes[body_hash] = len(body)
+                self._total_bytes += len(body)
+            self._write_entry(url, {
+                'url': url,
+                'body_hash': body_hash,
+                'size': len(body),
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'stored_at': now,
+                'accessed_at': now,
+            })
+            index_path = self._index_path(url)
+            previous = self._entries.get(index_path)
+            self._entries[index_path] = [now, body_hash]
+            self._refs[body_hash] += 1
+            # URL的正文变化后，旧正文没有其他URL引用就立即删除
+            if previous is not None:
+                self._release(previous[1])
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def evict(self):
+        """按最近访问时间淘汰条目，直到总大小低于上限的EVICT_TO"""
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        target = self.max_bytes * self.EVICT_TO
+        for index_path, (_, body_hash) in sorted(self._entries.items(), key=lambda item: item[1][0]):
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(index_path)
+            except FileNotFoundError:
+                pass
+            del self._entries[index_path]
+            self._release(body_hash)
+
+    def _release(self, body_hash):
+        # 同一正文可能被多个URL引用，只有引用全部释放后才删除正文
+        self._refs[body_hash] -= 1
+        if self._refs[body_hash] <= 0:
+            del self._refs[body_hash]
+            self._total_bytes -= self._blob_sizes.pop(body_hash, 0)
+            self._remove_blob_file(body_hash)
+
+    def _remove_blob_file(self, body_hash):
+        try:
+            os.remove(self._blob_path(body_hash))
+        except FileNotFoundError:
+            pass
+
+class HttpClient:
+    """复用keep-alive连接的HTTP客户端，所有请求都经过按主机限速，可选磁盘缓存"""
+
+    def __init__(self, max_workers=8, rate_per_host=1.0, burst=2, timeout=10, headers=None, cache=None,
+                 retries=0):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = cache
+        self.limiter = HostRateLimiter(rate=rate_per_host, burst=burst)
+        self.session = requests.Session()
+        self.session.headers.update(headers or DEFAULT_HEADERS)
+        # 连接失败和5xx/429按指数退避重试，重试用尽后返回最后一次的响应
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, **kwargs):
+        self.limiter.acquire(url)
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def fetch(self, url, ttl=None):
+        """获取URL内容（bytes），优先使用缓存，过期后发送条件请求重新验证"""
+        with stage('fetch'):
+            body = self._fetch(url, ttl)
+        get_metrics().incr('http.bytes', len(body))
+        return body
+
+    def _fetch(self, url, ttl):
+        metrics = get_metrics()
+        if self.cache is None:
+            metrics.incr('http.downloaded')
+            response = self.get(url)
+            response.raise_for_status()
+            return response.content
+
+        entry = self.cache.lookup(url)
+        if entry and self.cache.is_fresh(entry, ttl):
+            body = self.cache.read_body(url, entry)
+            if body is not None:
+                metrics.incr('http.cache_hit')
+                return body
+            entry = None
+
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self.get(url, headers=headers)
+        if response.status_code == 304 and entry:
+            body = self.cache.read_body(url, entry)
+            if body is not None:
+                metrics.incr('http.not_modified')
+                self.cache.revalidated(url, entry, response.headers)
+                return body
+            # 正文已被淘汰，重新完整下载
+            response = self.get(url)
+
+        response.raise_for_status()
+        metrics.incr('http.downloaded')
+        self.cache.store(url, response.content, response.headers)
+        return response.content
+
+    def close(self):
+        self.session.close()
+
+_http_client = None
+
+def get_http_client():
+    """获取进程内共享的HTTP客户端（带磁盘缓存）"""
+    global _http_client
+    if _http_client is None:
+        _http_client = HttpClient(cache=HttpCache())
+    return _http_client
+
+# 各网站正文所在的容器选择器
+ARTICLE_SELECTORS = {
+    'fiercebiotech': '.article-content',
+    'biospace': '.article__body',
+}
+
+def parse_article_content(url, html):
+    """从文章页面HTML（str或bytes）中提取正文"""
+    soup = BeautifulSoup(html, 'html.parser')
+    
+    # 根据网站调整选择器
+    for site, selector in ARTICLE_SELECTORS.items():
+        if site in url:
+            article_body = soup.select_one(selector)
+            if article_body:
+                paragraphs = article_body.select('p')
+                return ' '.join([p.text.strip() for p in paragraphs])
+            break
+    
+    return ""
+
+def get_article_content(url, client=None):
     """获取单个文章的详细内容"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
+    client = client or get_http_client()
     
     try:
-        response = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        content = ""
-        
-        # 根据网站调整选择器
-        if 'fiercebiotech' in url:
-            article_body = soup.select_one('.article-content')
-            if article_body:
-                paragraphs = article_body.select('p')
-                content = ' '.join([p.text.strip() for p in paragraphs])
-        
-        elif 'biospace' in url:
-            article_body = soup.select_one('.article__body')
-            if article_body:
-                paragraphs = article_body.select('p')
-                content = ' '.join([p.text.strip() for p in paragraphs])
-        
-        return content
+        html = client.fetch(url, ttl=ARTICLE_CACHE_TTL)
+        with stage('parse'):
+            return parse_article_content(url, html)
     except Exception as e:
-        print(f"获取文章内容错误 {url}: {str(e)}")
+        get_metrics().incr('fetch.errors')
+        logger.warning(f"获取文章内容错误 {url}: {str(e)}")
         return ""
 
+def _needs_fetch(item, min_content_length=100):
+    return len(item.get('content', '')) < min_content_length and bool(item.get('link'))
+
+def _fetch_item(item, client):
+    content = get_article_content(item['link'], client)
+    if content:
+        item['content'] = content
+    return item
+
+def iter_fetched_articles(news_items, client=None, max_workers=None, min_content_length=100):
+    """流式抓取：逐条读取新闻，内容过短的并发抓取正文，按完成顺序产出；同时在途的请求数有上限"""
+    client = client or get_http_client()
+    max_workers = max_workers or client.max_workers
+    
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch') as executor:
+        in_flight = set()
+        for item in news_items:
+            if not _needs_fetch(item, min_content_length):
+                yield item
+                continue
+            in_flight.add(executor.submit(_fetch_item, item, client))
+            if len(in_flight) >= 2 * max_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(in_flight):
+            yield future.result()
+
+def fetch_articles(news_list, client=None, max_workers=None, min_content_length=100):
+    """并发抓取内容过短的文章正文，直接写回news_list"""
+    pending = sum(1 for item in news_list if _needs_fetch(item, min_content_length))
+    if pending:
+        logger.info(f"并发抓取 {pending} 篇文章正文")
+        for _ in iter_fetched_articles(news_list, client, max_workers, min_content_length):
+            pass
+    return news_list
+
 def store_news(news_list):
-    """存储新闻，保留最近一周的新闻"""
+    """在一个事务中批量写入新闻，保留最近一周的新闻"""
     if not news_list:
-        print("没有新闻要存储")
+        logger.info("没有新闻要存储")
         return
     
-    conn = sqlite3.connect('news.db')
-    c = conn.cursor()
-    
-    # 删除一周以前的新闻
     week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-    c.execute("DELETE FROM news WHERE date < ?", (week_ago,))
+    today = datetime.now().strftime('%Y-%m-%d')
+    rows = [(
+        item['title'],
+        item['link'],
+        item['source'],
+        item.get('content', ''),
+        item.get('summary', ''),
+        item.get('date', today),
+        item.get('content_hash') or news_content_hash(item)
+    ) for item in news_list]
     
-    for item in news_list:
+    try:
+        with stage('store'), get_db() as conn:
+            # 删除一周以前的新闻
+            conn.execute("DELETE FROM news WHERE date < ?", (week_ago,))
+            evict_caches(conn)
+            conn.executemany("""
+                INSERT INTO news (title, link, source, content, summary, date, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(link) DO UPDATE SET
+                    title = excluded.title,
+                    source = excluded.source,
+                    content = excluded.content,
+                    summary = excluded.summary,
+                    date = excluded.date,
+                    content_hash = excluded.content_hash,
+                    entity_kb_version = NULL
+            """, rows)
+    except sqlite3.Error as e:
+        get_metrics().incr('store.errors')
+        logger.error(f"存储新闻时出错: {str(e)}")
+        return
+    
+    get_metrics().incr('store.rows', len(news_list))
+    logger.info(f"成功存储 {len(news_list)} 条新闻")
+
+def fts_query(text, phrase=False, any_term=False):
+    """把用户输入转换成安全的FTS5查询：每个词加引号；phrase按短语匹配，any_term时任一词匹配即可"""
+    terms = re.findall(r'\w+', text or '')
+    if not terms:
+        return None
+    if phrase:
+        return '"' + ' '.join(terms) + '"'
+    return (' OR ' if any_term else ' ').join(f'"{term}"' for term in terms)
+
+def search_news(query, since=None, until=None, source=None, limit=20, phrase=False):
+    """按相关度全文检索已存储的新闻，可按日期和来源过滤"""
+    match = fts_query(query, phrase=phrase)
+    if match is None:
+        return []
+    
+    c = get_db().cursor()
+    # 标题命中的权重最高，其次是摘要
+    c.execute("""
+        SELECT n.id, n.title, n.link, n.source, n.date,
+               snippet(news_fts, -1, '[', ']', '...', 16) AS snippet,
+               bm25(news_fts, 10.0, 1.0, 3.0) AS rank
+        FROM news_fts JOIN news n ON n.id = news_fts.rowid
+        WHERE news_fts MATCH ?
+          AND (? IS NULL OR n.date >= ?)
+          AND (? IS NULL OR n.date <= ?)
+          AND (? IS NULL OR n.source = ?)
+        ORDER BY rank
+        LIMIT ?
+    """, (match, since, since, until, until, source, source, limit))
+    
+    return [{
+        'id': row[0],
+        'title': row[1],
+        'link': row[2],
+        'source': row[3],
+        'date': row[4],
+        'snippet': row[5],
+        'rank': row[6]
+    } for row in c.fetchall()]
+
+RSS_SOURCES = {
+    'FierceBiotech': 'https://www.fiercebiotech.com/rss/xml',
+    'BioSpace': 'https://www.biospace.com/all-news.rss',
+    'stat': 'https://www.statnews.com/feed/'
+}
+
+_PIPELINE_DONE = object()
+
+class _PipelineError:
+    """上游阶段抛出的异常，经队列交给下游重新抛出"""
+
+    def __init__(self, error):
+        self.error = error
+
+def _pump(iterable, outbox):
+    """在后台线程中把上游的输出逐条放入有界队列；上游出错时把异常放入队列而不是当作正常结束"""
+    try:
+        for item in iterable:
+            outbox.put(item)
+    except BaseException as e:
+        outbox.put(_PipelineError(e))
+    else:
+        outbox.put(_PIPELINE_DONE)
+
+def buffered(iterable, maxsize=64):
+    """让上游阶段在独立线程中运行，经有界队列逐条产出；下游处理不过来时上游阻塞（背压），上游的异常在下游重新抛出"""
+    outbox = queue.Queue(maxsize=maxsize)
+    # 线程以上游生成器命名，py-spy等采样工具里能直接看出是哪个阶段
+    name = f"pipeline-{getattr(iterable, '__name__', 'stage')}"
+    threading.Thread(target=_pump, args=(iterable, outbox), name=name, daemon=True).start()
+    while True:
+        item = outbox.get()
+        if item is _PIPELINE_DONE:
+            return
+        if isinstance(item, _PipelineError):
+            # 已经提交的批次留在数据库里，本次运行以失败结束
+            raise item.error
+        yield item
+
+def chunked(iterable, size):
+    """把流按size条一组切分"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_feed_entries(rss_sources, client, stats, require_summary=True):
+    """并发抓取各RSS源，每个源完成后立即产出其中新的或内容有变化的文章"""
+    with ThreadPoolExecutor(max_workers=len(rss_sources)) as executor:
+        futures = [executor.submit(scrape_rss, rss_url, source, client)
+                   for source, rss_url in rss_sources.items()]
+        for future in as_completed(futures):
+            news_list = future.result()
+            # 只有新文章或内容有变化的文章才进入抓取和摘要阶段
+            for item in news_list:
+                item['content_hash'] = news_content_hash(item)
+            new_news = filter_unseen_news(news_list, require_summary)
+            stats['found'] += len(news_list)
+            stats['new'] += len(new_news)
+            yield from new_news
+
+def iter_summarized(news_items, batch_size=16):
+    """按批生成摘要后逐条产出；多进程摘要时每批按进程数放大，让每个进程都分到一整批"""
+    for batch in chunked(news_items, batch_size * get_summarizer().workers):
         try:
-            c.execute("""
-                INSERT OR REPLACE INTO news (title, link, source, content, summary, date)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                item['title'],
-                item['link'],
-                item['source'],
-                item.get('content', ''),
-                item.get('summary', ''),
-                item.get('date', datetime.now().strftime('%Y-%m-%d'))
-            ))
+            summarize_news(batch)
         except Exception as e:
-            print(f"存储新闻时出错: {str(e)}")
-    
-    conn.commit()
-    conn.close()
-    print(f"成功存储 {len(news_list)} 条新闻")
+            logger.warning(f"生成摘要时出错: {str(e)}")
+            for item in batch:
+                item['summary'] = item['title'] if not item.get('content') else ''
+        yield from batch
 
-def process_news():
-    """主处理函数"""
+def process_news(rss_sources=None, client=None, queue_size=64, summary_batch_size=16, store_batch_size=20,
+                 summarize=True):
+    """主处理函数：抓取 → 正文 → 摘要 → 存储的流式流水线，返回最近一周在RSS中找到的新闻条数
+    
+    summarize为False时只抓取和存储正文，摘要留给summarize_stored_news，不加载任何模型
+    """
     # 初始化数据库
     init_database()
     
-    # 更新RSS源
-    rss_sources = {
-        'FierceBiotech': 'https://www.fiercebiotech.com/rss/xml',
-        'BioSpace': 'https://www.biospace.com/all-news.rss',
-        'stat': 'https://www.statnews.com/feed/'
-    }
-    
-    all_news = []
-    
-    for source, rss_url in rss_sources.items():
-        time.sleep(2)  # 添加延迟
-        news_list = scrape_rss(rss_url, source)
-        
-        if news_list:
-            for item in news_list:
-                try:
-                    # 如果内容太短，尝试从原文页面获取
-                    if len(item.get('content', '')) < 100:
-                        time.sleep(1)
-                        content = get_article_content(item['link'])
-                        if content:
-                            item['content'] = content
-                    
-                    # 生成摘要
-                    if item['content']:
-                        summary = summarize_news([{'content': item['content']}])[0]['summary']
-                        item['summary'] = summary
-                    else:
-                        item['summary'] = item['title']  # 如果没有内容，使用标题作为摘要
-                    
-                except Exception as e:
-                    print(f"处理文章内容时出错: {str(e)}")
-                    item['summary'] = item['title']
-            
-            all_news.extend(news_list)
+    rss_sources = rss_sources or RSS_SOURCES
+    client = client or get_http_client()
+    stats = {'found': 0, 'new': 0, 'stored': 0}
+    
+    entries = buffered(iter_feed_entries(rss_sources, client, stats, require_summary=summarize), queue_size)
+    fetched = buffered(iter_fetched_articles(entries, client), queue_size)
+    if summarize:
+        fetched = buffered(iter_summarized(fetched, summary_batch_size), queue_size)
+    
+    # 每凑满一小批就提交，中途失败也不会丢失已完成的文章
+    for batch in chunked(fetched, store_batch_size):
+        if not summarize:
+            for item in batch:
+                item['summary'] = ''
+        store_news(batch)
+        stats['stored'] += len(batch)
+        if summarize:
+            try:
+                index_article_entities([item['link'] for item in batch])
+            except Exception as e:
+                logger.warning(f"建立实体索引时出错: {str(e)}")
     
-    if all_news:
-        store_news(all_news)
-        print(f"总共处理了 {len(all_news)} 条新闻")
-        return all_news
+    for name, value in stats.items():
+        get_metrics().incr(f"pipeline.{name}", value)
+    if stats['found']:
+        logger.info(f"{stats['found'] - stats['new']} 条新闻已处理过，跳过；总共处理了 {stats['stored']} 条新闻")
     else:
-        print("没有找到任何新闻")
-        return []
+        logger.info("没有找到任何新闻")
+    return stats['found']
 
-# Step 2: Summarization
-def summarize_news(news_items, max_length=150):
-    """改进的新闻摘要函数"""
-    summarizer = pipeline("summarization", model="sshleifer/distilbart-cnn-12-6")
-    
-    for item in news_items:
+def summarize_stored_news(batch_size=16):
+    """为已存储但还没有摘要的文章生成摘要，返回处理的条数"""
+    init_database()
+    conn = get_db()
+    rows = conn.execute("""
+        SELECT id, link, title, content FROM news
+        WHERE summary IS NULL OR summary = ''
+    """).fetchall()
+    if not rows:
+        logger.info("没有需要生成摘要的新闻")
+        return 0
+    
+    news_items = [{'id': news_id, 'link': link, 'title': title, 'content': content or ''}
+                  for news_id, link, title, content in rows]
+    for batch in chunked(iter_summarized(news_items, batch_size), batch_size):
+        with conn:
+            # 摘要变了，实体需要重新提取
+            conn.executemany("UPDATE news SET summary = ?, entity_kb_version = NULL WHERE id = ?",
+                             [(item['summary'], item['id']) for item in batch])
         try:
-            content = item.get('content', '')
-            if not content:
-                item['summary'] = item['title']
-                continue
-                
-            # 限制输入长度
-            content = ' '.join(content.split()[:512])  # 限制词数
-            
-            # 根据输入长度动态调整max_length
-            input_length = len(content.split())
-            max_length = min(max_length, input_length - 1)  # 确保摘要短于输入
-            min_length = min(30, max_length - 1)  # 动态设置最小长度
-            
-            summary = summarizer(content, 
-                               max_length=max_length,
-                               min_length=min_length,
-                               do_sample=False)[0]['summary_text']
-            
-            item['summary'] = summary
-            
+            index_article_entities([item['link'] for item in batch])
         except Exception as e:
-            print(f"生成摘要时出错: {str(e)}")
-            item['summary'] = item['title']  # 使用标题作为后备摘要
+            logger.warning(f"建立实体索引时出错: {str(e)}")
     
+    logger.info(f"为 {len(news_items)} 条新闻生成了摘要")
+    return len(news_items)
+
+# Step 2: Summarization
+SUMMARIZER_MODEL = "sshleifer/distilbart-cnn-12-6"
+
+# 本地模型目录（export-model导出），设置后只从该目录加载，不访问网络
+SUMMARIZER_MODEL_DIR = None
+
+# torch为原始的fp32模型；quantized对线性层做int8动态量化；onnx用ONNX Runtime推理（需要optimum[onnxruntime]）
+SUMMARIZER_BACKENDS = ('torch', 'quantized', 'onnx')
+SUMMARIZER_BACKEND = 'torch'
+
+def _has_onnx_files(directory):
+    return os.path.isdir(directory) and any(name.endswith('.onnx') for name in os.listdir(directory))
+
+def load_summarization_pipeline(model_name, backend='torch', device=-1):
+    """按后端加载摘要pipeline；model_name是本地目录时只读本地文件"""
+    if backend not in SUMMARIZER_BACKENDS:
+        raise ValueError(f"未知的摘要后端: {backend}")
+    from transformers import AutoTokenizer, pipeline
+    local_files_only = os.path.isdir(model_name)
+    tokenizer = AutoTokenizer.from_pretrained(model_name, local_files_only=local_files_only)
+    if backend == 'onnx':
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        # 目录里已有导出好的ONNX文件时直接加载，否则从PyTorch权重现场导出
+        model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=not _has_onnx_files(model_name),
+                                                     local_files_only=local_files_only)
+        return pipeline("summarization", model=model, tokenizer=tokenizer)
+
+    from transformers import AutoModelForSeq2SeqLM
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name, local_files_only=local_files_only)
+    if backend == 'quantized':
+        # 动态量化只需几秒，保存量化后的权重反而无法用from_pretrained加载，所以每次加载时现做
+        import torch
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return pipeline("summarization", model=model, tokenizer=tokenizer, device=device)
+
+def export_summarizer_model(output_dir, model_name=SUMMARIZER_MODEL, backend='torch'):
+    """下载模型并保存到本地目录，之后可离线加载；backend为onnx时保存导出的ONNX模型"""
+    if backend not in SUMMARIZER_BACKENDS:
+        raise ValueError(f"未知的摘要后端: {backend}")
+    from transformers import AutoTokenizer
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+    if backend == 'onnx':
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True).save_pretrained(output_dir)
+    else:
+        from transformers import AutoModelForSeq2SeqLM
+        AutoModelForSeq2SeqLM.from_pretrained(model_name).save_pretrained(output_dir)
+    logger.info(f"已将摘要模型 {model_name} 保存到 {output_dir}")
+    return output_dir
+
+def _summarizer_cache_key(model_name, backend):
+    """摘要缓存按模型区分；不同后端的输出略有差异，非torch后端单独缓存"""
+    return model_name if backend == 'torch' else f"{model_name}#{backend}"
+
+# 长文先按模型窗口切块分别摘要，再对拼接起来的块摘要继续摘要，最多进行这么多轮
+SUMMARY_MAX_ROUNDS = 3
+
+_SENTENCE_END = re.compile(r'(?<=[.!?。！？])\s+')
+
+def split_into_chunks(text, tokenizer, max_tokens):
+    """按句子把正文切成不超过max_tokens个token的窗口；一个窗口放得下时原样返回，超长的句子按token硬切"""
+    budget = max_tokens - tokenizer.num_special_tokens_to_add()
+    if len(tokenizer(text, add_special_tokens=False)['input_ids']) <= budget:
+        return [text]
+
+    sentences = [sentence for sentence in _SENTENCE_END.split(text.strip()) if sentence]
+    chunks = []
+    current, size = [], 0
+    for sentence, input_ids in zip(sentences, tokenizer(sentences, add_special_tokens=False)['input_ids']):
+        if current and size + len(input_ids) > budget:
+            chunks.append(' '.join(current))
+            current, size = [], 0
+        if len(input_ids) > budget:
+            chunks.extend(tokenizer.decode(input_ids[start:start + budget], skip_special_tokens=True)
+                          for start in range(0, len(input_ids), budget))
+            continue
+        current.append(sentence)
+        size += len(input_ids)
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+class Summarizer:
+    """常驻的摘要服务：每个进程只加载一次模型，按长度分桶后批量生成摘要"""
+    workers = 1
+
+    def __init__(self, model_name=None, batch_size=8, max_input_tokens=1024, device=-1, backend=None):
+        self.model_name = model_name or SUMMARIZER_MODEL_DIR or SUMMARIZER_MODEL
+        self.backend = backend or SUMMARIZER_BACKEND
+        self.batch_size = batch_size
+        self.max_input_tokens = max_input_tokens
+        self.device = device
+        self.cache_key = _summarizer_cache_key(self.model_name, self.backend)
+        self._pipeline = None
+
+    @property
+    def pipeline(self):
+        """首次使用时加载模型，之后复用"""
+        if self._pipeline is None:
+            logger.info(f"加载摘要模型: {self.model_name}（{self.backend}）")
+            self._pipeline = load_summarization_pipeline(self.model_name, self.backend, self.device)
+        return self._pipeline
+
+    @property
+    def tokenizer(self):
+        return self.pipeline.tokenizer
+
+    def _truncate(self, text):
+        """按token上限截断输入，返回截断后的文本和token数"""
+        input_ids = self.tokenizer(text, truncation=True, max_length=self.max_input_tokens)['input_ids']
+        return self.tokenizer.decode(input_ids, skip_special_tokens=True), len(input_ids)
+
+    def _buckets(self, lengths):
+        """按输入长度排序后切分批次，使同一批次内的长度相近以减少padding"""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        for start in range(0, len(order), self.batch_size):
+            yield order[start:start + self.batch_size]
+
+    def summarize(self, texts, max_length=150, min_length=30):
+        """批量生成摘要，返回与输入顺序一致的列表；空输入或失败的位置为None"""
+        results = [None] * len(texts)
+        indices = [i for i, text in enumerate(texts) if text]
+        if not indices:
+            return results
+
+        with stage('summarize'):
+            self._summarize_into(results, texts, indices, max_length, min_length)
+        return results
+
+    def _summarize_into(self, results, texts, indices, max_length, min_length):
+        metrics = get_metrics()
+        truncated = [self._truncate(texts[i]) for i in indices]
+        lengths = [n_tokens for _, n_tokens in truncated]
+        metrics.incr('summarize.texts', len(indices))
+
+        for bucket in self._buckets(lengths):
+            batch = [truncated[k][0] for k in bucket]
+            # 以批次内最短的输入为准，确保摘要短于输入
+            batch_max_length = max(2, min(max_length, min(lengths[k] for k in bucket) - 1))
+            batch_min_length = max(1, min(min_length, batch_max_length - 1))
+            metrics.observe('summarize.batch_size', len(batch))
+            try:
+                with metrics.timer('summarize.batch_seconds'):
+                    outputs = self.pipeline(batch,
+                                            max_length=batch_max_length,
+                                            min_length=batch_min_length,
+                                            do_sample=False,
+                                            truncation=True,
+                                            batch_size=len(batch))
+                for k, output in zip(bucket, outputs):
+                    results[indices[k]] = output['summary_text']
+            except Exception as e:
+                metrics.incr('summarize.errors')
+                logger.warning(f"生成摘要时出错: {str(e)}")
+
+# 多进程摘要：每个工作进程各自加载一份模型，线程数按核数均分，避免多个进程抢同一批核
+SUMMARIZER_WORKERS = 1
+
+def _init_summarizer_worker(model_name, backend, threads):
+    """摘要进程启动时限制线程数并创建进程内的摘要服务，模型在第一批任务时加载"""
+    global _summarizer
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    # 分词器自带的线程池同样会和其他进程争抢CPU
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError):
+        pass
+    _summarizer = Summarizer(model_name=model_name, backend=backend)
+
+def _summarize_shard(texts, max_length, min_length, batch_size, max_input_tokens):
+    """在工作进程中为一个分片生成摘要"""
+    _summarizer.batch_size = batch_size
+    _summarizer.max_input_tokens = max_input_tokens
+    return _summarizer.summarize(texts, max_length=max_length, min_length=min_length)
+
+class SummarizerPool:
+    """多进程摘要服务：按长度排序后把文本切成分片分给各工作进程，结果按提交顺序取回"""
+
+    def __init__(self, workers, model_name=None, batch_size=8, max_input_tokens=1024, threads=None, backend=None):
+        self.workers = workers
+        self.model_name = model_name or SUMMARIZER_MODEL_DIR or SUMMARIZER_MODEL
+        self.backend = backend or SUMMARIZER_BACKEND
+        self.cache_key = _summarizer_cache_key(self.model_name, self.backend)
+        self.batch_size = batch_size
+        self.max_input_tokens = max_input_tokens
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        self._executor = None
+        self._fallback = None
+        self._tokenizer = None
+
+    @property
+    def tokenizer(self):
+        """切块只需要分词器，主进程不加载模型"""
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_name,
+                                                            local_files_only=os.path.isdir(self.model_name))
+        return self._tokenizer
+
+    @property
+    def executor(self):
+        """首次使用时启动工作进程，之后复用"""
+        if self._executor is None:
+            logger.info(f"启动 {self.workers} 个摘要进程，每个进程 {self.threads} 个线程")
+            # 父进程可能已经初始化过torch的线程池，fork出来的子进程容易死锁，所以用spawn
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_summarizer_worker,
+                                                 initargs=(self.model_name, self.backend, self.threads))
+        return self._executor
+
+    def _shards(self, texts, indices):
+        """按长度排序后切分，让同一分片内的长度相近；文本不多时缩小分片使每个进程都有活干"""
+        order = sorted(indices, key=lambda i: len(texts[i]))
+        size = max(1, min(self.batch_size, -(-len(order) // self.workers)))
+        return [order[start:start + size] for start in range(0, len(order), size)]
+
+    def summarize(self, texts, max_length=150, min_length=30):
+        """批量生成摘要，返回与输入顺序一致的列表；空输入或失败的位置为None"""
+        results = [None] * len(texts)
+        indices = [i for i, text in enumerate(texts) if text]
+        if not indices:
+            return results
+
+        metrics = get_metrics()
+        shards = self._shards(texts, indices)
+        with stage('summarize'):
+            if self._fallback is None:
+                try:
+                    futures = [self.executor.submit(_summarize_shard, [texts[i] for i in shard], max_length,
+                                                    min_length, self.batch_size, self.max_input_tokens)
+                               for shard in shards]
+                    metrics.incr('summarize.texts', len(indices))
+                    for shard, future in zip(shards, futures):
+                        metrics.observe('summarize.shard_size', len(shard))
+                        for i, summary in zip(shard, future.result()):
+                            results[i] = summary
+                    return results
+                except (OSError, BrokenProcessPool) as e:
+                    logger.warning(f"摘要进程池不可用，改为在当前进程中生成摘要: {str(e)}")
+                    self.close()
+                    self._fallback = Summarizer(self.model_name, self.batch_size, self.max_input_tokens,
+                                                backend=self.backend)
+            self._fallback.batch_size = self.batch_size
+            self._fallback.max_input_tokens = self.max_input_tokens
+            self._fallback._summarize_into(results, texts, indices, max_length, min_length)
+        return results
+
+    def close(self):
+        """关闭工作进程"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+_summarizer = None
+
+def get_summarizer(batch_size=None, max_input_tokens=None, workers=None, backend=None):
+    """获取进程内共享的摘要服务，可调整批大小、输入token上限、工作进程数（大于1时使用多进程）和推理后端"""
+    global _summarizer
+    current = getattr(_summarizer, 'workers', 1) if _summarizer is not None else SUMMARIZER_WORKERS
+    current_backend = getattr(_summarizer, 'backend', backend) if _summarizer is not None else SUMMARIZER_BACKEND
+    workers = workers or current
+    backend = backend or current_backend
+    if _summarizer is not None and (current != workers or current_backend != backend):
+        if isinstance(_summarizer, SummarizerPool):
+            _summarizer.close()
+        _summarizer = None
+    if _summarizer is None:
+        _summarizer = SummarizerPool(workers, backend=backend) if workers > 1 else Summarizer(backend=backend)
+    if batch_size is not None:
+        _summarizer.batch_size = batch_size
+    if max_input_tokens is not None:
+        _summarizer.max_input_tokens = max_input_tokens
+    return _summarizer
+
+def _summarize_cached(summarizer, texts, max_length):
+    """texts为 {内容哈希: 文本}，只为没有命中摘要缓存的文本生成摘要，返回 {内容哈希: 摘要}"""
+    summaries = load_cached_summaries(set(texts), summarizer.cache_key, max_length)
+    pending = {h: text for h, text in texts.items() if h not in summaries}
+    if pending:
+        generated = summarizer.summarize(list(pending.values()), max_length=max_length)
+        new_summaries = {h: summary for h, summary in zip(pending, generated) if summary}
+        save_cached_summaries(new_summaries, summarizer.cache_key, max_length)
+        summaries.update(new_summaries)
+    return summaries
+
+def map_reduce_summaries(summarizer, documents, max_length=150, max_rounds=SUMMARY_MAX_ROUNDS):
+    """documents为 {内容哈希: 正文}，返回 {内容哈希: 摘要}
+    
+    放得进模型窗口的正文直接摘要；长文切成窗口大小的块，和其他文章一起作为一批生成摘要，
+    再把同一篇的块摘要拼接起来作为新的正文进入下一轮。块摘要按块的内容缓存，文章修改后只有变化的块需要重新摘要
+    """
+    metrics = get_metrics()
+    results = {}
+    long_documents = set()
+    for round_index in range(max_rounds):
+        if not documents:
+            break
+        # 最后一轮不再切块，超出窗口的部分由摘要服务截断
+        if round_index == max_rounds - 1:
+            chunks = {h: [text] for h, text in documents.items()}
+        else:
+            chunks = {h: split_into_chunks(text, summarizer.tokenizer, summarizer.max_input_tokens)
+                      for h, text in documents.items()}
+        pieces = {text_hash(chunk): chunk for doc_chunks in chunks.values() for chunk in doc_chunks}
+        metrics.incr('summarize.chunks', sum(len(doc_chunks) for doc_chunks in chunks.values() if len(doc_chunks) > 1))
+        summaries = _summarize_cached(summarizer, pieces, max_length)
+
+        documents = {}
+        for h, doc_chunks in chunks.items():
+            parts = [summaries.get(text_hash(chunk)) for chunk in doc_chunks]
+            if not all(parts):
+                continue
+            if len(parts) == 1:
+                results[h] = parts[0]
+            else:
+                documents[h] = ' '.join(parts)
+                long_documents.add(h)
+
+    # 长文的最终摘要也按整篇的哈希缓存，内容不变时不必重新切块
+    save_cached_summaries({h: results[h] for h in long_documents if h in results}, summarizer.cache_key, max_length)
+    return results
+
+def summarize_news(news_items, max_length=150, batch_size=None, max_input_tokens=None):
+    """改进的新闻摘要函数，整批送入共享的摘要服务，长文按模型窗口切块后分段摘要"""
+    summarizer = get_summarizer(batch_size=batch_size, max_input_tokens=max_input_tokens)
+    contents = [item.get('content', '') for item in news_items]
+    hashes = [text_hash(content) if content else None for content in contents]
+
+    # 相同内容、模型和长度设置的摘要直接复用缓存
+    summaries = load_cached_summaries({h for h in hashes if h}, summarizer.cache_key, max_length)
+    pending = {}
+    for h, content in zip(hashes, contents):
+        if h and h not in summaries:
+            pending.setdefault(h, content)
+    get_metrics().incr('summarize.cache_hits', len(summaries))
+    if summaries:
+        logger.info(f"{len(summaries)} 篇文章的摘要命中缓存")
+
+    if pending:
+        summaries.update(map_reduce_summaries(summarizer, pending, max_length))
+
+    failed = 0
+    for item, h in zip(news_items, hashes):
+        # 没有内容时用标题作为摘要；生成失败的留空，下次运行会重新摘要，报告里临时显示标题
+        item['summary'] = summaries.get(h, '') if h else item['title']
+        failed += bool(h) and not item['summary']
+    if failed:
+        get_metrics().incr('summarize.failed', failed)
+        logger.warning(f"{failed} 篇文章的摘要生成失败，留待下次重试")
+
     return news_items
 
 # Step 3: Data Visualization
-def load_knowledge_base():
-    """加载知识库"""
-    companies = set()
-    drugs = set()
-    indications = set()
-    
-    # 加载公司名称
+KNOWLEDGE_BASE_FILES = ('company_names.txt', 'drug_names.txt', 'indication.txt')
+
+# 文本文件是可编辑的知识库源，编译成二进制文件后供实体提取和知识库刷新快速加载
+KB_ARTIFACT = 'knowledge_base.kb'
+KB_CATEGORIES = ('company', 'drug', 'indication')
+
+# 药物按名称后缀归类，依次判断，都不符合的归入其他药物
+DRUG_CLASSES = (
+    ('单克隆抗体', ('mab', 'umab', 'zumab', 'ximab')),
+    ('激酶抑制剂', ('nib', 'tinib')),
+)
+OTHER_DRUG_CLASS = '其他药物'
+DRUG_CLASS_LABELS = tuple(label for label, _ in DRUG_CLASSES) + (OTHER_DRUG_CLASS,)
+
+# 文件头：魔数、格式版本、字节序、源文件内容摘要、源文件路径/大小/修改时间的指纹、名称数、哈希槽数、字符串区长度
+_KB_MAGIC = b'NSKB'
+_KB_FORMAT = 2
+_KB_HEADER = struct.Struct('<4sBB2x32s32sIII')
+_KB_BYTEORDER = 0 if sys.byteorder == 'little' else 1
+
+def drug_class(name):
+    """按名称后缀判断药物类别"""
+    lower = name.lower()
+    for label, suffixes in DRUG_CLASSES:
+        if lower.endswith(suffixes):
+            return label
+    return OTHER_DRUG_CLASS
+
+def read_kb_names(path):
+    """读取知识库文本文件中的名称，文件不存在时返回空集合"""
     try:
-        with open('company_names.txt', 'r', encoding='utf-8') as f:
-            companies = {line.strip() for line in f if line.strip() and not line.startswith('#')}
-        print(f"从知识库加载了 {len(companies)} 个公司名称")
-    except Exception as e:
-        print(f"加载公司名称时出错: {str(e)}")
+        with open(path, 'r', encoding='utf-8') as f:
+            return {line.strip() for line in f if line.strip() and not line.startswith('#')}
+    except FileNotFoundError:
+        return set()
+
+class KnowledgeBase:
+    """编译后的知识库：排序的字符串表加开放寻址哈希表，可直接mmap，按名称O(1)查询类别
     
-    # 加载药物名称
+    布局：文件头 | 偏移数组(uint32, n+1) | 哈希槽(uint32, 下标+1, 0为空) | 类别位图(uint8) | 药物类别(uint8) | 字符串区
+    """
+
+    def __init__(self, buffer):
+        magic, fmt, byteorder, digest, sources, count, n_slots, strings_len = _KB_HEADER.unpack_from(buffer, 0)
+        if magic != _KB_MAGIC or fmt != _KB_FORMAT or byteorder != _KB_BYTEORDER:
+            raise ValueError("知识库文件格式不兼容，需要重新编译")
+        self._buffer = buffer
+        self.version = digest.hex()
+        self.sources = sources
+        self._count = count
+        self._mask = n_slots - 1
+        
+        view = memoryview(buffer)
+        pos = _KB_HEADER.size
+        self._offsets = view[pos:pos + 4 * (count + 1)].cast('I')
+        pos += 4 * (count + 1)
+        self._slots = view[pos:pos + 4 * n_slots].cast('I')
+        pos += 4 * n_slots
+        self._flags = view[pos:pos + count]
+        pos += count
+        self._drug_classes = view[pos:pos + count]
+        pos += count
+        self._strings = view[pos:pos + strings_len]
+
+    @classmethod
+    def open(cls, path=KB_ARTIFACT):
+        """以只读mmap方式打开编译好的知识库，不把整个文件读入内存"""
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return self._count
+
+    def _encoded(self, index):
+        return self._strings[self._offsets[index]:self._offsets[index + 1]]
+
+    def name(self, index):
+        return bytes(self._encoded(index)).decode('utf-8')
+
+    def _find(self, name):
+        encoded = name.encode('utf-8')
+        slot = zlib.crc32(encoded) & self._mask
+        while True:
+            entry = self._slots[slot]
+            if not entry:
+                return -1
+            if self._encoded(entry - 1) == encoded:
+                return entry - 1
+            slot = (slot + 1) & self._mask
+
+    def __contains__(self, name):
+        return self._find(name) >= 0
+
+    def categories(self, name):
+        """返回名称所属的类别，不在知识库中时返回空元组"""
+        index = self._find(name)
+        if index < 0:
+            return ()
+        return tuple(category for bit, category in enumerate(KB_CATEGORIES) if self._flags[index] & (1 << bit))
+
+    def drug_class(self, name):
+        """返回药物类别，不是药物时返回None"""
+        index = self._find(name)
+        if index < 0 or not self._drug_classes[index]:
+            return None
+        return DRUG_CLASS_LABELS[self._drug_classes[index] - 1]
+
+    def names(self, category):
+        """按字典序返回某一类别的所有名称"""
+        bit = 1 << KB_CATEGORIES.index(category)
+        return [self.name(index) for index in range(self._count) if self._flags[index] & bit]
+
+def kb_artifact_path(kb_files=KNOWLEDGE_BASE_FILES):
+    """默认知识库编译到KB_ARTIFACT；其他源文件编译到第一个源文件所在目录，文件名带上源文件路径的摘要"""
+    if tuple(kb_files) == KNOWLEDGE_BASE_FILES:
+        return KB_ARTIFACT
+    key = '\0'.join(os.path.abspath(source) for source in kb_files)
+    name = f"knowledge_base.{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.kb"
+    return os.path.join(os.path.dirname(kb_files[0]), name)
+
+def kb_source_stamp(kb_files):
+    """源文件的绝对路径、大小和修改时间的指纹，不读文件内容就能判断编译结果是否过期"""
+    stamp = hashlib.sha256()
+    for source in kb_files:
+        try:
+            stat = os.stat(source)
+            state = f"{stat.st_size}:{stat.st_mtime_ns}"
+        except OSError:
+            state = 'missing'
+        stamp.update(f"{os.path.abspath(source)}\0{state}\0".encode('utf-8'))
+    return stamp.digest()
+
+def compile_knowledge_base(kb_files=KNOWLEDGE_BASE_FILES, path=None):
+    """把知识库文本文件编译成二进制文件，版本戳为源文件内容的摘要"""
+    path = path or kb_artifact_path(kb_files)
+    # 先取指纹再读内容，读的过程中源文件被修改时下次打开会重新编译
+    sources = kb_source_stamp(kb_files)
+    digest = hashlib.sha256(f"{_KB_FORMAT}".encode('utf-8'))
+    flags = defaultdict(int)
+    for bit, source in enumerate(kb_files):
+        try:
+            with open(source, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            logger.warning(f"知识库文件不存在: {source}")
+            data = b''
+        digest.update(data)
+        digest.update(b'\0')
+        for line in data.decode('utf-8').splitlines():
+            if line.strip() and not line.startswith('#'):
+                flags[line.strip()] |= 1 << bit
+    
+    names = sorted(flags)
+    encoded = [name.encode('utf-8') for name in names]
+    offsets = array('I', [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    
+    # 槽数取不小于名称数两倍的2的幂，装载率不超过一半
+    n_slots = 1
+    while n_slots < 2 * len(names):
+        n_slots *= 2
+    slots = array('I', bytes(4 * n_slots))
+    for index, data in enumerate(encoded):
+        slot = zlib.crc32(data) & (n_slots - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (n_slots - 1)
+        slots[slot] = index + 1
+    
+    drug_bit = 1 << KB_CATEGORIES.index('drug')
+    drug_classes = bytes(DRUG_CLASS_LABELS.index(drug_class(name)) + 1 if flags[name] & drug_bit else 0
+                         for name in names)
+    
+    header = _KB_HEADER.pack(_KB_MAGIC, _KB_FORMAT, _KB_BYTEORDER, digest.digest(), sources,
+                             len(names), n_slots, offsets[-1])
+    _write_atomic(path, [header, offsets.tobytes(), slots.tobytes(), bytes(flags[name] for name in names),
+                         drug_classes, b''.join(encoded)], mode='wb')
+    logger.info(f"编译了知识库 {path}: {len(names)} 个名称")
+
+def open_knowledge_base(kb_files=KNOWLEDGE_BASE_FILES, path=None):
+    """打开编译好的知识库，编译结果不是由当前这些源文件生成、源文件有变化或格式不兼容时先重新编译"""
+    path = path or kb_artifact_path(kb_files)
     try:
-        with open('drug_names.txt', 'r', encoding='utf-8') as f:
-            drugs = {line.strip() for line in f if line.strip() and not line.startswith('#')}
-        print(f"从知识库加载了 {len(drugs)} 个药物名称")
-    except Exception as e:
-        print(f"加载药物名称时出错: {str(e)}")
+        kb = KnowledgeBase.open(path)
+        if kb.sources == kb_source_stamp(kb_files):
+            return kb
+    except (OSError, ValueError):
+        pass
+    compile_knowledge_base(kb_files, path)
+    return KnowledgeBase.open(path)
+
+def load_knowledge_base(kb_files=KNOWLEDGE_BASE_FILES):
+    """加载知识库"""
+    kb = open_knowledge_base(kb_files)
+    companies, drugs, indications = (set(kb.names(category)) for category in KB_CATEGORIES)
     
-    # 加载适应症
-    try:
-        with open('indication.txt', 'r', encoding='utf-8') as f:
-            indications = {line.strip() for line in f if line.strip() and not line.startswith('#')}
-        print(f"从知识库加载了 {len(indications)} 个适应症")
-    except Exception as e:
-        print(f"加载适应症时出错: {str(e)}")
+    logger.info(f"从知识库加载了 {len(companies)} 个公司名称、{len(drugs)} 个药物名称、{len(indications)} 个适应症")
     
     return companies, drugs, indications
 
-def extract_entities(text):
-    """改进的实体提取函数，使用知识库"""
-    if not text or not isinstance(text, str):
-        return [], [], []
-    
-    # 加载知识库
-    known_companies, known_drugs, known_indications = load_knowledge_base()
-    
-    # 将文本转换为小写以进行匹配
-    text_lower = text.lower()
-    
-    companies = []
-    drugs = []
-    indications = []
-    
-    # 1. 从知识库匹配公司名称
-    for company in known_companies:
-        if company.lower() in text_lower:
-            companies.append(company)
-    
-    # 2. 从知识库匹配药物名称
-    for drug in known_drugs:
-        if drug.lower() in text_lower:
-            drugs.append(drug)
-    
-    # 3. 从知识库匹配适应症
-    for indication in known_indications:
-        if indication.lower() in text_lower:
-            indications.append(indication)
+class EntityMatcher:
+    """把多个词表编译成一个Aho–Corasick自动机，一次扫描文本找出所有匹配（忽略大小写，检查单词边界）"""
+
+    def __init__(self, term_sets):
+        # term_sets: {类别: 词表}
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for category, terms in term_sets.items():
+            for term in terms:
+                if term:
+                    self._add(term, category)
+        self._build()
+
+    def _add(self, term, category):
+        state = 0
+        for char in term.lower():
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        # 词首词尾是字母数字时才需要检查单词边界
+        self._output[state].append((len(term.lower()), category, term,
+                                    term[0].isalnum(), term[-1].isalnum()))
+
+    def _build(self):
+        """按层次遍历计算失败指针，并合并后缀状态的输出"""
+        # 根节点的直接子节点失败指针都指向根
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, text):
+        """返回所有匹配 (类别, 词条, 起始偏移, 结束偏移)，偏移基于原始文本"""
+        folded = text.lower()
+        # 个别字符小写后长度会变化，此时需要把偏移映射回原始文本
+        offsets = None
+        if len(folded) != len(text):
+            offsets = []
+            for i, char in enumerate(text):
+                offsets.extend([i] * len(char.lower()))
+            offsets.append(len(text))
+
+        goto, fail, output = self._goto, self._fail, self._output
+        matches = []
+        state = 0
+        for end, char in enumerate(folded, start=1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not output[state]:
+                continue
+            for length, category, term, check_start, check_end in output[state]:
+                start = end - length
+                if check_start and start > 0 and folded[start - 1].isalnum():
+                    continue
+                if check_end and end < len(folded) and folded[end].isalnum():
+                    continue
+                if offsets is not None:
+                    matches.append((category, term, offsets[start], offsets[end]))
+                else:
+                    matches.append((category, term, start, end))
+        return matches
+
+def build_entity_matcher(companies, drugs, indications):
+    """用知识库的三个词表构建实体匹配器"""
+    return EntityMatcher({'company': companies, 'drug': drugs, 'indication': indications})
+
+# 实体缓存中保存的是带偏移的提及列表，格式变化时需要让旧缓存失效
+ENTITY_CACHE_FORMAT = 2
+
+# 只读取doc.ents，词性标注、句法分析和词形还原都用不到
+SPACY_DISABLED_COMPONENTS = ['tagger', 'parser', 'attribute_ruler', 'lemmatizer']
+
+class EntityContext:
+    """进程内共享的实体提取上下文：知识库和spaCy模型只加载一次，知识库文件修改后自动重建"""
+
+    def __init__(self, kb_files=KNOWLEDGE_BASE_FILES, spacy_model='en_core_web_sm'):
+        self.kb_files = kb_files
+        self.spacy_model = spacy_model
+        self.matcher = None
+        self.kb_version = None
+        self._mtimes = None
+        self._nlp = None
+        self._lock = threading.Lock()
+
+    def _current_mtimes(self):
+        mtimes = []
+        for path in self.kb_files:
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _compute_kb_version(self, kb):
+        """知识库版本戳、spaCy模型名和缓存格式共同决定实体提取结果"""
+        key = f"{ENTITY_CACHE_FORMAT}:{self.spacy_model}:{kb.version}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get_matcher(self):
+        """返回知识库匹配器，知识库文件的修改时间变化时重新加载"""
+        mtimes = self._current_mtimes()
+        if mtimes != self._mtimes:
+            with self._lock:
+                if mtimes != self._mtimes:
+                    logger.info("知识库文件有变化，重新构建实体匹配器")
+                    kb = open_knowledge_base(self.kb_files)
+                    self.matcher = build_entity_matcher(*(kb.names(category) for category in KB_CATEGORIES))
+                    self.kb_version = self._compute_kb_version(kb)
+                    self._mtimes = mtimes
+        return self.matcher
+
+    @property
+    def nlp(self):
+        """spaCy模型，只保留实体识别需要的组件"""
+        if self._nlp is None:
+            with self._lock:
+                if self._nlp is None:
+                    import spacy
+                    nlp = spacy.load(self.spacy_model)
+                    nlp.select_pipes(disable=[name for name in SPACY_DISABLED_COMPONENTS
+                                              if name in nlp.pipe_names])
+                    self._nlp = nlp
+        return self._nlp
+
+_entity_context = None
+
+def get_entity_context():
+    """获取进程内共享的实体提取上下文"""
+    global _entity_context
+    if _entity_context is None:
+        _entity_context = EntityContext()
+    return _entity_context
+
+# 研发代号的正则模式
+DRUG_CODE_PATTERNS = [
+    re.compile(r'\b[A-Z]{2,3}-\d{3,4}\b'),  # 例如: AB-123
+    re.compile(r'\b[A-Z]{2,3}\d{3,4}\b'),   # 例如: AB123
+]
+
+COMPANY_KEYWORDS = ['therapeutics', 'pharma', 'biotech', 'pharmaceuticals', 
+                    'biosciences', 'medicines', 'medical', 'health',
+                    'technologies', 'labs', 'laboratory']
+
+def _collect_entity_mentions(text, matcher, doc):
+    """合并知识库匹配、研发代号和spaCy识别的ORG，返回所有提及 (类型, 名称, 起始偏移, 结束偏移)"""
+    # 1-3. 一次扫描匹配知识库中的公司、药物和适应症
+    mentions = list(matcher.find(text))
     
     # 4. 使用正则表达式补充识别研发代号
-    drug_patterns = [
-        r'\b[A-Z]{2,3}-\d{3,4}\b',  # 例如: AB-123
-        r'\b[A-Z]{2,3}\d{3,4}\b',   # 例如: AB123
-    ]
-    
-    for pattern in drug_patterns:
-        matches = re.finditer(pattern, text)
-        for match in matches:
-            drug_name = match.group()
-            if drug_name not in drugs:  # 避免重复
-                drugs.append(drug_name)
+    for pattern in DRUG_CODE_PATTERNS:
+        for match in pattern.finditer(text):
+            mentions.append(('drug', match.group(), match.start(), match.end()))
     
     # 5. 使用spaCy补充识别未知的公司名称
-    nlp = spacy.load('en_core_web_sm')
-    doc = nlp(text)
-    
-    company_keywords = ['therapeutics', 'pharma', 'biotech', 'pharmaceuticals', 
-                       'biosciences', 'medicines', 'medical', 'health',
-                       'technologies', 'labs', 'laboratory']
-    
     for ent in doc.ents:
         if ent.label_ == 'ORG':
             company_name = ent.text.strip()
             # 如果公司名称包含关键词但不在知识库中
-            if (any(keyword in company_name.lower() for keyword in company_keywords) and 
-                company_name not in companies):
-                companies.append(company_name)
-    
-    # 清理和去重
-    companies = list(set(companies))
-    drugs = list(set(drugs))
-    indications = list(set(indications))
-    
-    # 打印调试信息
-    print(f"\n提取的实体:")
-    print(f"公司: {len(companies)} 个")
-    print(f"药物: {len(drugs)} 个")
-    print(f"适应症: {len(indications)} 个")
-    
-    if companies:
-        print("\n示例公司:", companies[:5])
-    if drugs:
-        print("\n示例药物:", drugs[:5])
-    if indications:
-        print("\n示例适应症:", indications[:5])
+            if any(keyword in company_name.lower() for keyword in COMPANY_KEYWORDS):
+                mentions.append(('company', company_name, ent.start_char, ent.end_char))
+    
+    return mentions
+
+def _entity_lists(mentions):
+    """把提及列表整理成去重后的(公司, 药物, 适应症)"""
+    found = {'company': set(), 'drug': set(), 'indication': set()}
+    for entity_type, name, _, _ in mentions:
+        found[entity_type].add(name)
+    return list(found['company']), list(found['drug']), list(found['indication'])
+
+def extract_entities(text):
+    """改进的实体提取函数，使用知识库"""
+    if not text or not isinstance(text, str):
+        return [], [], []
+    
+    # 使用共享的知识库匹配器和spaCy模型
+    context = get_entity_context()
+    mentions = _collect_entity_mentions(text, context.get_matcher(), context.nlp(text))
+    companies, drugs, indications = _entity_lists(mentions)
+    
+    # 调试信息
+    logger.debug("提取的实体: 公司 %d 个 %s，药物 %d 个 %s，适应症 %d 个 %s",
+                 len(companies), companies[:5], len(drugs), drugs[:5], len(indications), indications[:5])
     
     return companies, drugs, indications
 
+def extract_entity_mentions_batch(texts, batch_size=64, n_process=1):
+    """批量实体提取：所有文本经nlp.pipe流式处理，返回每篇文本的提及列表 (类型, 名称, 起始偏移, 结束偏移)"""
+    context = get_entity_context()
+    matcher = context.get_matcher()
+    
+    hashes = [text_hash(text) if text and isinstance(text, str) else None for text in texts]
+    
+    # 相同文本在知识库未变化时直接复用缓存的实体
+    extracted = load_cached_entities({h for h in hashes if h}, context.kb_version)
+    pending = {}
+    for h, text in zip(hashes, texts):
+        if h and h not in extracted:
+            pending.setdefault(h, text)
+    
+    new_entities = {}
+    if pending:
+        with stage('extract'):
+            docs = context.nlp.pipe(pending.values(), batch_size=batch_size, n_process=n_process)
+            new_entities = {h: _collect_entity_mentions(text, matcher, doc)
+                            for (h, text), doc in zip(pending.items(), docs)}
+        save_cached_entities(new_entities, context.kb_version)
+        extracted.update(new_entities)
+    
+    get_metrics().incr('extract.texts', len(new_entities))
+    get_metrics().incr('extract.cache_hits', len(texts) - len(pending))
+    logger.info(f"批量提取了 {len(new_entities)} 篇文本的实体，{len(texts) - len(pending)} 篇命中缓存")
+    return [[tuple(mention) for mention in extracted[h]] if h else [] for h in hashes]
+
+def extract_entities_batch(texts, batch_size=64, n_process=1):
+    """批量实体提取，返回每篇文本的(公司, 药物, 适应症)"""
+    return [_entity_lists(mentions) for mentions in extract_entity_mentions_batch(texts, batch_size, n_process)]
+
+def article_entity_text(title, summary):
+    """入库时用于提取实体的文本，article_entity中的偏移基于该文本"""
+    return f"{title}. {summary}"
+
+def index_article_entities(links=None):
+    """为尚未提取实体（或知识库已更新）的文章提取实体，写入entity和article_entity表"""
+    conn = get_db()
+    context = get_entity_context()
+    context.get_matcher()
+    kb_version = context.kb_version
+    
+    if links is None:
+        rows = conn.execute("SELECT id, title, summary FROM news WHERE entity_kb_version IS NOT ?",
+                            (kb_version,)).fetchall()
+    else:
+        # _query_in_chunks先绑定IN列表再绑定其余参数
+        rows = _query_in_chunks(conn.cursor(), """
+            SELECT id, title, summary FROM news
+            WHERE link IN ({placeholders}) AND entity_kb_version IS NOT ?
+        """, links, (kb_version,))
+    if not rows:
+        return 0
+    
+    all_mentions = extract_entity_mentions_batch([article_entity_text(title, summary)
+                                                  for _, title, summary in rows])
+    
+    with stage('store'), conn:
+        for (news_id, _, _), mentions in zip(rows, all_mentions):
+            offsets = defaultdict(set)
+            for entity_type, name, start, end in mentions:
+                offsets[(name, entity_type)].add((start, end))
+            
+            conn.executemany("INSERT OR IGNORE INTO entity (name, type) VALUES (?, ?)", list(offsets))
+            conn.execute("DELETE FROM article_entity WHERE news_id = ?", (news_id,))
+            conn.executemany("""
+                INSERT INTO article_entity (news_id, entity_id, count, offsets)
+                SELECT ?, id, ?, ? FROM entity WHERE name = ? AND type = ?
+            """, [(news_id, len(spans), json.dumps(sorted(spans)), name, entity_type)
+                  for (name, entity_type), spans in offsets.items()])
+        conn.executemany("UPDATE news SET entity_kb_version = ? WHERE id = ?",
+                         [(kb_version, news_id) for news_id, _, _ in rows])
+    
+    logger.info(f"为 {len(rows)} 篇文章建立了实体索引")
+    return len(rows)
+
+def entity_frequencies(entity_type, since=None):
+    """统计提到每个实体的文章数，返回Counter"""
+    c = get_db().cursor()
+    c.execute("""
+        SELECT e.name, COUNT(*)
+        FROM article_entity ae
+        JOIN entity e ON e.id = ae.entity_id
+        JOIN news n ON n.id = ae.news_id
+        WHERE e.type = ? AND (? IS NULL OR n.date >= ?)
+        GROUP BY e.id
+    """, (entity_type, since, since))
+    return Counter(dict(c.fetchall()))
+
+def articles_mentioning(name, entity_type=None, since=None, limit=50):
+    """查找提到某个实体的文章，按日期倒序"""
+    c = get_db().cursor()
+    c.execute("""
+        SELECT n.id, n.title, n.link, n.source, n.date, e.type, ae.count
+        FROM entity e
+        JOIN article_entity ae ON ae.entity_id = e.id
+        JOIN news n ON n.id = ae.news_id
+        WHERE e.name = ? COLLATE NOCASE
+          AND (? IS NULL OR e.type = ?)
+          AND (? IS NULL OR n.date >= ?)
+        ORDER BY n.date DESC
+        LIMIT ?
+    """, (name, entity_type, entity_type, since, since, limit))
+    return [{
+        'id': row[0],
+        'title': row[1],
+        'link': row[2],
+        'source': row[3],
+        'date': row[4],
+        'type': row[5],
+        'count': row[6]
+    } for row in c.fetchall()]
+
+def _figure_png(plt):
+    """把当前图形编码为PNG字节，不落盘"""
+    buffer = BytesIO()
+    plt.savefig(buffer, format='png', bbox_inches='tight', pad_inches=0.1)
+    plt.close()
+    return buffer.getvalue()
+
+def _message_png(plt, message):
+    """生成只包含一行提示文字的图片"""
+    plt.figure(figsize=(10, 6))
+    plt.text(0.5, 0.5, message, ha='center', va='center', fontsize=14)
+    plt.axis('off')
+    return _figure_png(plt)
+
 def create_wordcloud(words, title):
-    """改进的词云生成函数，添加默认空白图片处理"""
+    """改进的词云生成函数，添加默认空白图片处理；words可以是词列表或 {词: 频次}，返回PNG字节"""
+    import matplotlib.pyplot as plt
+    from wordcloud import WordCloud
+    
     if not words:
-        print(f"警告: {title} 没有数据")
+        logger.warning(f"{title} 没有数据")
         # 创建空白图片
-        plt.figure(figsize=(10, 6))
-        plt.text(0.5, 0.5, f'No {title} data available', 
-                ha='center', va='center', fontsize=14)
-        plt.axis('off')
-        
-        # 保存空白图片
-        filename = f"{title.lower().replace(' ', '_')}.png"
-        plt.savefig(filename, bbox_inches='tight', pad_inches=0.1)
-        plt.close()
-        return filename
+        return _message_png(plt, f'No {title} data available')
     
     try:
         # 统计词频
         word_freq = Counter(words)
         
-        # 打印词频统计用于调试
-        print(f"\n{title} 词频统计:")
-        for word, freq in sorted(word_freq.items(), key=lambda x: x[1], reverse=True)[:10]:
-            print(f"{word}: {freq}")
+        # 词频统计，调试用
+        logger.debug("%s 词频统计: %s", title, word_freq.most_common(10))
         
         # 创建词云
         wordcloud = WordCloud(
@@ -555,53 +2105,54 @@ def create_wordcloud(words, title):
         plt.axis('off')
         plt.title(title)
         
-        # 保存图片
-        filename = f"{title.lower().replace(' ', '_')}.png"
-        plt.savefig(filename, bbox_inches='tight', pad_inches=0.1)
-        plt.close()
-        
-        return filename
+        return _figure_png(plt)
         
     except Exception as e:
-        print(f"生成词云时出错 ({title}): {str(e)}")
+        logger.warning(f"生成词云时出错 ({title}): {str(e)}")
         # 创建错误提示图片
-        plt.figure(figsize=(10, 6))
-        plt.text(0.5, 0.5, f'Error generating {title} word cloud', 
-                ha='center', va='center', fontsize=14)
-        plt.axis('off')
-        
-        filename = f"{title.lower().replace(' ', '_')}.png"
-        plt.savefig(filename, bbox_inches='tight', pad_inches=0.1)
-        plt.close()
-        return filename
-
-def create_charts():
-    """改进的图表创建函数"""
-    conn = sqlite3.connect('news.db')
-    c = conn.cursor()
-    c.execute("SELECT title, summary FROM news")
-    all_texts = [f"{row[0]}. {row[1]}" for row in c.fetchall()]
-    conn.close()
-    
-    print(f"Processing {len(all_texts)} news articles")  # 调试信息
-    
-    # 提取所有实体
-    all_companies, all_drugs, all_indications = [], [], []
-    for text in all_texts:
-        companies, drugs, indications = extract_entities(text)
-        all_companies.extend(companies)
-        all_drugs.extend(drugs)
-        all_indications.extend(indications)
-    
-    # 打印调试信息
-    print(f"Found {len(set(all_companies))} unique companies")
-    print(f"Found {len(set(all_drugs))} unique drugs")
-    print(f"Found {len(set(all_indications))} unique indications")
+        return _message_png(plt, f'Error generating {title} word cloud')
+
+def png_data_uri(png):
+    return f"data:image/png;base64,{base64.b64encode(png).decode('utf-8')}"
+
+def _init_render_worker():
+    """渲染进程只输出图片文件，不需要交互式后端"""
+    import matplotlib
+    matplotlib.use('Agg')
+
+def render_wordclouds(frequencies, max_workers=None):
+    """在独立进程中并行渲染多个词云，frequencies为 [(词频, 标题)]，返回PNG字节列表"""
+    words, titles = zip(*frequencies)
+    max_workers = max_workers or min(len(frequencies), os.cpu_count() or 1)
+    if max_workers > 1:
+        try:
+            # 与摘要进程池一样用spawn：run命令里此时已加载torch，fork带有OpenMP线程池的进程可能死锁
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_render_worker) as executor:
+                return list(executor.map(create_wordcloud, words, titles))
+        except (OSError, BrokenProcessPool) as e:
+            logger.warning(f"并行渲染词云失败，改为逐个渲染: {str(e)}")
+    return [create_wordcloud(word_freq, title) for word_freq, title in frequencies]
+
+def create_charts(max_workers=None):
+    """改进的图表创建函数，词频直接从实体索引聚合，返回三张词云的data URI"""
+    # 补齐尚未建立实体索引的文章（例如知识库更新后）
+    index_article_entities()
+    
+    company_freq = entity_frequencies('company')
+    drug_freq = entity_frequencies('drug')
+    indication_freq = entity_frequencies('indication')
+    
+    # 调试信息
+    logger.info(f"Found {len(company_freq)} unique companies, {len(drug_freq)} unique drugs, "
+                f"{len(indication_freq)} unique indications")
     
     # 创建词云图
-    company_cloud = create_wordcloud(all_companies, "Company Names")
-    drug_cloud = create_wordcloud(all_drugs, "Drug Names")
-    indication_cloud = create_wordcloud(all_indications, "Indications")
+    with stage('render'):
+        images = render_wordclouds([(company_freq, "Company Names"),
+                                    (drug_freq, "Drug Names"),
+                                    (indication_freq, "Indications")], max_workers)
+    company_cloud, drug_cloud, indication_cloud = [png_data_uri(png) for png in images]
     
     return company_cloud, drug_cloud, indication_cloud
 
@@ -651,14 +2202,161 @@ def group_similar_news(news_list, similarity_threshold=0.6):
 
     return grouped_news
 
-def combine_similar_news(all_news, title_similarity_threshold=0.6, summary_similarity_threshold=0.5):
-    """改进的新闻合并函数，提供更好的去重和摘要"""
+# 新闻数量超过该值时，先用MinHash LSH生成候选对，再精确计算相似度；
+# 几百篇时LSH与逐对比较的分组一致且快一个数量级，只有很少的新闻才值得直接逐对比较
+LSH_MIN_ARTICLES = 150
+
+SHINGLE_STOPWORDS = {'a', 'an', 'and', 'as', 'at', 'by', 'for', 'from', 'in', 'is', 'its',
+                     'of', 'on', 'or', 'the', 'to', 'with'}
+
+def text_shingles(text):
+    """把文本切分成去除停用词的小写单词集合"""
+    return {word for word in re.findall(r'\w+', (text or '').lower()) if word not in SHINGLE_STOPWORDS}
+
+def char_shingles(text, n=3):
+    """小写并合并空白后的字符n-gram集合；分组按字符级相似度判断，词形变化的标题也能成为候选"""
+    text = ' '.join(re.findall(r'\w+', (text or '').lower()))
+    # 空文本也给一个共同的片段，让空标题、空摘要的文章互为候选，和逐对比较的结果一致
+    return {text[i:i + n] for i in range(max(1, len(text) - n + 1))} if text else {''}
+
+class MinHashLSH:
+    """MinHash局部敏感哈希索引：签名分段入桶，同桶的文本成为候选对"""
+
+    # 小于2^32的最大素数：a、b和crc32哈希都小于2^32，a*h+b不会溢出uint64
+    _PRIME = 4294967291
+
+    # 每段3行、128段：n-gram集合的Jaccard约0.3以上的文本对几乎都会成为候选，只共享少量片段的文本对很少入选
+    def __init__(self, num_perm=384, bands=128, seed=1):
+        self.bands = bands
+        self.rows = num_perm // bands
+        import numpy as np
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, self._PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, self._PRIME, num_perm, dtype=np.uint64)
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+
+    def signature(self, shingles):
+        if not shingles:
+            return None
+        import numpy as np
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self._a) + self._b) % self._PRIME).min(axis=0)
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, key, signature):
+        if signature is None:
+            return
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band][band_key].append(key)
+
+    def query(self, signature):
+        candidates = set()
+        if signature is None:
+            return candidates
+        for band, band_key in self._band_keys(signature):
+            candidates.update(self._buckets[band].get(band_key, ()))
+        return candidates
+
+def find_candidate_pairs(news_list):
+    """对标题和摘要分别建立LSH索引，返回每条新闻的候选相似新闻下标（升序）"""
+    title_index = MinHashLSH()
+    summary_index = MinHashLSH()
+    signatures = []
+    for i, news in enumerate(news_list):
+        title_sig = title_index.signature(char_shingles(news['title']))
+        summary_sig = summary_index.signature(char_shingles(news['summary']))
+        title_index.add(i, title_sig)
+        summary_index.add(i, summary_sig)
+        signatures.append((title_sig, summary_sig))
+
+    candidates = []
+    for i, (title_sig, summary_sig) in enumerate(signatures):
+        found = title_index.query(title_sig) | summary_index.query(summary_sig)
+        found.discard(i)
+        candidates.append(sorted(found))
+    return candidates
+
+def find_candidate_pairs_fts(news_list, top_k=20):
+    """用全文索引为每条已入库的新闻（带id）检索标题相近的新闻，返回候选下标（升序）"""
+    index_by_id = {news['id']: i for i, news in enumerate(news_list) if news.get('id') is not None}
+    since = min((news['date'] for news in news_list), default=None)
+    c = get_db().cursor()
+    
+    candidates = []
+    for i, news in enumerate(news_list):
+        match = fts_query(' '.join(text_shingles(news['title'])), any_term=True)
+        found = set()
+        if match is not None:
+            c.execute("""
+                SELECT news_fts.rowid FROM news_fts JOIN news n ON n.id = news_fts.rowid
+                WHERE news_fts MATCH ? AND n.date >= ?
+                ORDER BY bm25(news_fts, 10.0, 1.0, 3.0)
+                LIMIT ?
+            """, (match, since, top_k + 1))
+            found = {index_by_id[row[0]] for row in c.fetchall() if row[0] in index_by_id}
+        found.discard(i)
+        candidates.append(sorted(found))
+    return candidates
+
+def find_similar_pairs_tfidf(news_list, threshold=0.5, top_k=20, chunk_size=2000):
+    """用TF-IDF向量按块批量计算稀疏余弦相似度，返回每条新闻相似度不低于阈值的前top_k个邻居下标（升序）"""
+    import numpy as np
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    
+    texts = [f"{news['title']} {news['summary']}" for news in news_list]
+    # TfidfVectorizer默认做L2归一化，点积即余弦相似度
+    matrix = TfidfVectorizer(stop_words='english').fit_transform(texts).tocsr()
+    
+    neighbors = []
+    for start in range(0, matrix.shape[0], chunk_size):
+        similarities = (matrix[start:start + chunk_size] @ matrix.T).tocsr()
+        for row in range(similarities.shape[0]):
+            begin, end = similarities.indptr[row], similarities.indptr[row + 1]
+            columns = similarities.indices[begin:end]
+            scores = similarities.data[begin:end]
+            keep = (scores >= threshold) & (columns != start + row)
+            columns, scores = columns[keep], scores[keep]
+            if len(columns) > top_k:
+                top = np.argpartition(-scores, top_k)[:top_k]
+                columns = columns[top]
+            neighbors.append(sorted(columns.tolist()))
+    return neighbors
+
+def _may_reach(text1, text2, threshold):
+    """相似度上界2*min/(len1+len2)低于阈值时不可能相似，无需精确计算；两个空串的相似度为1，与逐对比较一致"""
+    total = len(text1) + len(text2)
+    return total == 0 or 2 * min(len(text1), len(text2)) / total >= threshold
+
+# 相似新闻分组方式：sequence为逐对比较标题和摘要，tfidf为稀疏矩阵批量计算余弦相似度
+GROUPING_BACKENDS = ('sequence', 'tfidf')
+
+def combine_similar_news(all_news, title_similarity_threshold=0.6, summary_similarity_threshold=0.5,
+                         use_lsh=None, use_fts=False, backend='sequence', tfidf_threshold=0.5, tfidf_top_k=20):
+    """改进的新闻合并函数，提供更好的去重和摘要；可选逐对比较或TF-IDF矩阵分组"""
+    if backend not in GROUPING_BACKENDS:
+        raise ValueError(f"未知的分组方式: {backend}")
+
     combined_news = []
     used_indices = set()
 
     # 按日期排序，最新的新闻优先
     sorted_news = sorted(all_news, key=lambda x: x['date'], reverse=True)
 
+    if backend == 'tfidf':
+        # 邻居已经按阈值筛选过，无需再逐对比较
+        candidates = find_similar_pairs_tfidf(sorted_news, tfidf_threshold, tfidf_top_k) if sorted_news else []
+    elif use_fts:
+        # 新闻来自数据库（带id）时，可以直接用全文索引生成候选对
+        candidates = find_candidate_pairs_fts(sorted_news)
+    else:
+        if use_lsh is None:
+            use_lsh = len(sorted_news) > LSH_MIN_ARTICLES
+        candidates = find_candidate_pairs(sorted_news) if use_lsh else None
+
     for i, news in enumerate(sorted_news):
         if i in used_indices:
             continue
@@ -678,12 +2376,19 @@ def combine_similar_news(all_news, title_similarity_threshold=0.6, summary_simil
         used_indices.add(i)
 
         # 查找相似的新闻
-        for j, other_news in enumerate(sorted_news):
+        others = candidates[i] if candidates is not None else range(len(sorted_news))
+        for j in others:
             if j not in used_indices:
-                title_similarity = calculate_title_similarity(main_title, other_news['title'])
-                summary_similarity = calculate_title_similarity(main_summary, other_news['summary'])
+                other_news = sorted_news[j]
+                if backend == 'tfidf':
+                    similar = True
+                else:
+                    similar = ((_may_reach(main_title, other_news['title'], title_similarity_threshold) and
+                                calculate_title_similarity(main_title, other_news['title']) >= title_similarity_threshold) or
+                               (_may_reach(main_summary, other_news['summary'], summary_similarity_threshold) and
+                                calculate_title_similarity(main_summary, other_news['summary']) >= summary_similarity_threshold))
                 
-                if title_similarity >= title_similarity_threshold or summary_similarity >= summary_similarity_threshold:
+                if similar:
                     similar_sources.append({
                         'source': other_news['source'],
                         'date': other_news['date'],
@@ -700,11 +2405,13 @@ def combine_similar_news(all_news, title_similarity_threshold=0.6, summary_simil
             main_summary = max(all_summaries, key=len)
             
             # 提取关键信息
-            key_points = set()
+            # 用dict去重以保留句子顺序，同样的输入每次得到同样的综合摘要
+            key_points = {}
             for source in similar_sources:
                 # 使用NLTK分句
+                import nltk
                 sentences = nltk.sent_tokenize(source['summary'])
-                key_points.update(sentences)
+                key_points.update(dict.fromkeys(sentences))
             
             # 限制关键点数量
             key_points = list(key_points)[:3]  # 最多保留3个关键点
@@ -737,11 +2444,9 @@ def combine_similar_news(all_news, title_similarity_threshold=0.6, summary_simil
     
     return filtered_news
 
-def generate_html():
-    """改进的HTML生成函数"""
-    try:
-        # 更新模板，改进显示格式
-        template_content = '''
+# 报告模板，进程内只编译一次
+REPORT_TEMPLATES = {
+    'report.html': '''
         <!DOCTYPE html>
         <html>
         <head>
@@ -840,6 +2545,11 @@ def generate_html():
                     color: #666;
                     margin-top: 10px;
                 }
+                .news-day {
+                    color: #2c3e50;
+                    border-bottom: 1px solid #eee;
+                    padding-bottom: 5px;
+                }
             </style>
         </head>
         <body>
@@ -863,7 +2573,16 @@ def generate_html():
             
             <div class="news-section">
                 <h2>热点新闻</h2>
-                {% for group in combined_news %}
+                {% if fragments is none %}
+                {% for group in combined_news %}{% include 'news_group.html' %}{% endfor %}
+                {% else %}
+                {% for fragment in fragments %}{{ fragment }}{% endfor %}
+                {% endif %}
+            </div>
+        </body>
+        </html>
+        ''',
+    'news_group.html': '''
                 <div class="news-group">
                     <div class="news-title">{{ group.title }}</div>
                     <div class="news-summary">{{ group.summary }}</div>
@@ -877,26 +2596,94 @@ def generate_html():
                         {% endfor %}
                     </div>
                 </div>
-                {% endfor %}
-            </div>
-        </body>
-        </html>
-        '''
-        
-        # 创建临时template文件
-        with open('template.html', 'w', encoding='utf-8') as f:
-            f.write(template_content)
-            
-        # 其余代码保持不变
-        env = Environment(loader=FileSystemLoader('.'))
-        template = env.get_template('template.html')
+''',
+    'news_day.html': '''
+                <h3 class="news-day">{{ day }}</h3>
+                {% for group in groups %}{% include 'news_group.html' %}{% endfor %}
+''',
+}
+
+REPORT_FRAGMENT_DIR = 'report_fragments'
+
+_report_environment = None
+
+def get_report_environment():
+    """获取进程内共享的Jinja2环境，模板编译结果缓存在环境中"""
+    global _report_environment
+    if _report_environment is None:
+        _report_environment = Environment(loader=DictLoader(REPORT_TEMPLATES))
+    return _report_environment
+
+def _group_digest(groups):
+    """一天内各新闻组的内容摘要，连同模板一起决定片段是否需要重新渲染"""
+    digest = hashlib.sha256(REPORT_TEMPLATES['news_day.html'].encode('utf-8'))
+    digest.update(REPORT_TEMPLATES['news_group.html'].encode('utf-8'))
+    digest.update(json.dumps(groups, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def iter_day_fragments(combined_news, fragment_dir=REPORT_FRAGMENT_DIR):
+    """按主报道日期把新闻组分成每天一个HTML片段，内容没变的日期直接复用上次渲染的片段"""
+    os.makedirs(fragment_dir, exist_ok=True)
+    template = get_report_environment().get_template('news_day.html')
+    
+    days = defaultdict(list)
+    for group in combined_news:
+        days[group['sources'][0]['date']].append(group)
+    
+    current = set()
+    rendered = 0
+    for day in sorted(days, reverse=True):
+        groups = days[day]
+        path = os.path.join(fragment_dir, f"{day}-{_group_digest(groups)}.html")
+        current.add(os.path.basename(path))
+        if not os.path.exists(path):
+            _write_atomic(path, template.generate(day=day, groups=groups))
+            rendered += 1
+        with open(path, 'r', encoding='utf-8') as f:
+            yield f.read()
+    
+    # 清理内容已过期的片段
+    for name in os.listdir(fragment_dir):
+        if name.endswith('.html') and name not in current:
+            os.remove(os.path.join(fragment_dir, name))
+    logger.info(f"报告共 {len(days)} 天，重新渲染了 {rendered} 天的片段")
+
+def _write_atomic(path, chunks, mode='w'):
+    """把流式输出逐块写入临时文件，完成后再替换目标文件，读者不会看到写了一半的报告
+    
+    临时文件名唯一，多个进程同时写同一个文件时互不干扰，最后一个完成的替换生效
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp',
+                                    dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, mode, encoding=None if 'b' in mode else 'utf-8') as f:
+            # mkstemp创建的文件只有属主可读，沿用目标文件原有的权限
+            try:
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+            except FileNotFoundError:
+                os.chmod(tmp_path, 0o644)
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def generate_html(grouping_backend='sequence', charts=None, incremental=False,
+                  fragment_dir=REPORT_FRAGMENT_DIR, output='news_report.html'):
+    """改进的HTML生成函数，charts为create_charts的结果，未提供时现场生成
+    
+    incremental为True时新闻按天渲染成片段并缓存在fragment_dir中，只重新渲染有变化的日期
+    """
+    try:
+        template = get_report_environment().get_template('report.html')
         
-        conn = sqlite3.connect('news.db')
-        c = conn.cursor()
+        c = get_db().cursor()
         
         week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
         c.execute("""
-            SELECT title, summary, link, source, date 
+            SELECT title, summary, link, source, date, id
             FROM news 
             WHERE date >= ?
             ORDER BY date DESC
@@ -904,39 +2691,41 @@ def generate_html():
         
         news = [{
             'title': row[0],
-            'summary': row[1],
+            # 还没有摘要（只抓取或摘要失败）的文章暂用标题代替
+            'summary': row[1] or row[0],
             'link': row[2],
             'source': row[3],
-            'date': row[4]
+            'date': row[4],
+            'id': row[5]
         } for row in c.fetchall()]
         
-        conn.close()
-        
-        combined_news = combine_similar_news(news)
-        company_cloud, drug_cloud, indication_cloud = create_charts()
+        with stage('group'):
+            combined_news = combine_similar_news(news, backend=grouping_backend)
+        get_metrics().incr('group.articles', len(news))
+        get_metrics().incr('group.groups', len(combined_news))
+        company_cloud, drug_cloud, indication_cloud = charts or create_charts()
         
-        def img_to_base64(img_path):
-            with open(img_path, 'rb') as f:
-                encoded = base64.b64encode(f.read()).decode('utf-8')
-            return f"data:image/png;base64,{encoded}"
+        fragments = iter_day_fragments(combined_news, fragment_dir) if incremental else None
         
-        html_content = template.render(
-            combined_news=combined_news,
-            company_cloud=img_to_base64(company_cloud),
-            drug_cloud=img_to_base64(drug_cloud),
-            indication_cloud=img_to_base64(indication_cloud),
-            date_range=f"{week_ago} to {datetime.now().strftime('%Y-%m-%d')}"
-        )
-        
-        # 保存生成的HTML
-        with open('news_report.html', 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        # 边渲染边写入文件，不在内存中拼出整份报告
+        with stage('render'):
+            _write_atomic(output, template.generate(
+                combined_news=combined_news,
+                fragments=fragments,
+                company_cloud=company_cloud,
+                drug_cloud=drug_cloud,
+                indication_cloud=indication_cloud,
+                date_range=f"{week_ago} to {datetime.now().strftime('%Y-%m-%d')}"
+            ))
             
     except Exception as e:
-        print(f"生成HTML时出错: {str(e)}")
+        logger.error(f"生成HTML时出错: {str(e)}")
         raise
 
 def generate_wordcloud(text, title):
+    import matplotlib.pyplot as plt
+    from wordcloud import WordCloud
+    
     wordcloud = WordCloud(width=800, height=400, background_color='white').generate(text)
     
     plt.figure(figsize=(10, 5))
@@ -955,6 +2744,9 @@ def cluster_similar_news(titles, summaries):
     # Combine titles and summaries for clustering
     combined_texts = [f"{t} {s}" for t, s in zip(titles, summaries)]
     
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.cluster import DBSCAN
+    
     # Create TF-IDF vectors
     vectorizer = TfidfVectorizer(stop_words='english')
     tfidf_matrix = vectorizer.fit_transform(combined_texts)
@@ -1015,211 +2807,319 @@ def process_feeds(feeds):
         'clustered_news': clustered_news
     }
 
-def update_company_database():
-    """从多个来源更新公司数据库"""
-    companies = set()
-    
-    # 1. 从生物科技ETF获取公司列表
-    try:
-        # iShares Nasdaq Biotechnology ETF (IBB)
-        ibb = yf.Ticker("IBB")
-        holdings = ibb.holdings
-        if holdings is not None:
-            companies.update(holdings.index)
-        
-        # SPDR S&P Biotech ETF (XBI)
-        xbi = yf.Ticker("XBI")
-        holdings = xbi.holdings
-        if holdings is not None:
-            companies.update(holdings.index)
-            
-        print(f"从ETF获取了 {len(companies)} 家公司")
-    except Exception as e:
-        print(f"从ETF获取公司列表时出错: {str(e)}")
+KB_SOURCE_URLS = {
+    'orange_book': "https://www.fda.gov/drugs/drug-approvals-and-databases/approved-drug-products-therapeutic-equivalence-evaluations-orange-book",
+    'drugs_at_fda': "https://www.accessdata.fda.gov/scripts/cder/drugsatfda/index.cfm",
+    'clinicaltrials': "https://clinicaltrials.gov/api/v2/studies",
+}
+
+# 单个请求的超时和重试次数，以及整个知识库刷新等待所有来源的总时限
+KB_REQUEST_TIMEOUT = 30
+KB_REQUEST_RETRIES = 3
+KB_REFRESH_TIMEOUT = 300
+
+KNOWN_DRUGS = {
+    # 单克隆抗体
+    'Humira', 'Keytruda', 'Opdivo', 'Avastin', 'Herceptin', 'Rituxan',
+    'Ocrevus', 'Darzalex', 'Dupixent', 'Stelara', 'Soliris', 'Entyvio',
+    
+    # 小分子药物
+    'Ibrutinib', 'Lenalidomide', 'Apixaban', 'Rivaroxaban', 'Tofacitinib',
+    'Baricitinib', 'Upadacitinib', 'Ruxolitinib',
+    
+    # 其他重要药物
+    'Ozempic', 'Wegovy', 'Mounjaro', 'Jardiance', 'Eliquis', 'Xarelto',
+    'Imbruvica', 'Revlimid', 'Xtandi', 'Skyrizi', 'Rinvoq', 'Vyvanse',
+    
+    # 生物制剂
+    'Lantus', 'Trulicity', 'Eylea', 'Enbrel', 'Prevnar', 'Gardasil'
+}
+
+def make_kb_client():
+    """知识库刷新专用的HTTP客户端：较长超时、自动重试、不缓存"""
+    return HttpClient(max_workers=4, rate_per_host=2.0, burst=2, timeout=KB_REQUEST_TIMEOUT,
+                      retries=KB_REQUEST_RETRIES)
+
+def fetch_etf_holdings(symbol, client, deadline=None):
+    """获取生物科技ETF的持仓公司；yfinance不支持设置超时，由fetch_kb_sources的总时限兜底"""
+    import yfinance as yf
     
-    # 2. 从FDA获取药品制造商列表
+    holdings = yf.Ticker(symbol).holdings
+    return set(holdings.index) if holdings is not None else set()
+
+def fetch_orange_book_manufacturers(client, deadline=None):
+    """从FDA Orange Book页面获取药品制造商列表"""
+    response = client.get(KB_SOURCE_URLS['orange_book'])
+    response.raise_for_status()
+    soup = BeautifulSoup(response.text, 'html.parser')
+    # 解析FDA页面获取制造商信息
+    # 具体解析规则需要根据FDA网页结构调整
+    manufacturers = set()  # 存储从FDA页面提取的制造商
+    return manufacturers
+
+def fetch_fda_drugs(client, deadline=None):
+    """从Drugs@FDA获取已批准药物列表"""
+    response = client.get(KB_SOURCE_URLS['drugs_at_fda'])
+    response.raise_for_status()
+    soup = BeautifulSoup(response.text, 'html.parser')
+    # 查找药物名称列表
+    drug_elements = soup.find_all('a', href=lambda x: x and 'appletter' in x)
+    return {elem.text.strip() for elem in drug_elements if elem.text.strip()}
+
+# ClinicalTrials.gov v2接口按pageToken翻页；每次刷新最多翻CLINICALTRIALS_MAX_PAGES页，且不超过刷新的总时限，
+# 没走完的部分记在检查点里，下次刷新接着翻，走完一遍后从头开始
+CLINICALTRIALS_PAGE_SIZE = 1000
+CLINICALTRIALS_MAX_PAGES = 100
+CLINICALTRIALS_CHECKPOINT = 'clinicaltrials_checkpoint.json'
+
+def iter_clinicaltrials_pages(client, page_token=None, page_size=CLINICALTRIALS_PAGE_SIZE):
+    """逐页获取以药物为干预措施的研究，产出 (本页研究列表, 下一页token)，一次只在内存中保留一页"""
+    params = {
+        'query.term': 'AREA[InterventionType]DRUG',
+        'fields': 'InterventionName,InterventionType',
+        'pageSize': page_size,
+        'format': 'json'
+    }
+    while True:
+        if page_token:
+            params['pageToken'] = page_token
+        response = client.get(KB_SOURCE_URLS['clinicaltrials'], params=params)
+        response.raise_for_status()
+        data = response.json()
+        page_token = data.get('nextPageToken')
+        yield data.get('studies', []), page_token
+        if not page_token:
+            return
+
+def study_drug_names(study):
+    """提取一项研究中类型为药物的干预措施名称"""
+    interventions = (study.get('protocolSection', {})
+                     .get('armsInterventionsModule', {})
+                     .get('interventions', []))
+    for intervention in interventions:
+        name = (intervention.get('name') or '').strip()
+        if name and intervention.get('type', 'DRUG') == 'DRUG':
+            yield name
+
+def _load_clinicaltrials_checkpoint(checkpoint_path):
+    """读取检查点和已收集的名称；名称文件中检查点之后追加的行属于未完成的页，丢弃"""
     try:
-        fda_url = "https://www.fda.gov/drugs/drug-approvals-and-databases/approved-drug-products-therapeutic-equivalence-evaluations-orange-book"
-        response = requests.get(fda_url)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            # 解析FDA页面获取制造商信息
-            # 具体解析规则需要根据FDA网页结构调整
-            manufacturers = set()  # 存储从FDA页面提取的制造商
-            companies.update(manufacturers)
-    except Exception as e:
-        print(f"从FDA获取制造商列表时出错: {str(e)}")
-    
-    # 3. 保存更新后的公司列表
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        with open(checkpoint['names_file'], 'r', encoding='utf-8') as f:
+            names = [line.rstrip('\n') for _, line in zip(range(checkpoint['names_written']), f)]
+        if len(names) == checkpoint['names_written']:
+            return checkpoint['page_token'], names
+    except (FileNotFoundError, KeyError, ValueError):
+        pass
+    return None, []
+
+def fetch_clinicaltrials_drugs(client, checkpoint_path=None, max_pages=None, deadline=None):
+    """分页流式获取临床试验中的药物名称，边翻页边去重，并记录检查点以便下次续传
+    
+    deadline为time.monotonic()的截止时刻，剩余时间不够一次请求的超时就不再翻下一页
+    """
+    checkpoint_path = checkpoint_path or CLINICALTRIALS_CHECKPOINT
+    max_pages = max_pages or CLINICALTRIALS_MAX_PAGES
+    names_file = f"{os.path.splitext(checkpoint_path)[0]}.names.txt"
+    
+    page_token, names = _load_clinicaltrials_checkpoint(checkpoint_path)
+    if page_token:
+        logger.info(f"从检查点继续抓取ClinicalTrials.gov，已有 {len(names)} 个药物")
+    seen = {name.casefold() for name in names}
+    
+    # 截掉上次中断时多写的行，之后只追加
+    with open(names_file, 'w', encoding='utf-8') as f:
+        f.writelines(name + "\n" for name in names)
+    
+    pages = 0
+    finished = False
+    with open(names_file, 'a', encoding='utf-8') as names_out:
+        try:
+            for studies, next_token in iter_clinicaltrials_pages(client, page_token):
+                for study in studies:
+                    for name in study_drug_names(study):
+                        if name.casefold() not in seen:
+                            seen.add(name.casefold())
+                            names.append(name)
+                            names_out.write(name + "\n")
+                names_out.flush()
+                # 先落盘名称再推进检查点
+                _write_atomic(checkpoint_path, [json.dumps({
+                    'page_token': next_token,
+                    'names_file': names_file,
+                    'names_written': len(names),
+                    'updated_at': datetime.now().isoformat()
+                })])
+                pages += 1
+                if not next_token:
+                    finished = True
+                    break
+                if pages >= max_pages:
+                    break
+                if deadline is not None and deadline - time.monotonic() < client.timeout:
+                    break
+        except requests.HTTPError as e:
+            # 检查点里的token可能已经失效，下次从头开始
+            if page_token and pages == 0 and e.response is not None and 400 <= e.response.status_code < 500:
+                logger.warning("检查点已失效，下次刷新将从第一页开始")
+                finished = True
+            else:
+                raise
+    
+    if finished:
+        os.remove(names_file)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        logger.info(f"ClinicalTrials.gov已全部翻完，共 {len(names)} 个药物")
+    else:
+        logger.info(f"本次翻了 {pages} 页ClinicalTrials.gov，共 {len(names)} 个药物，下次从检查点继续")
+    return set(names)
+
+# 来源函数的签名为 fetch(client, deadline=None)，deadline为time.monotonic()的截止时刻
+COMPANY_SOURCES = {
+    'ETF IBB': partial(fetch_etf_holdings, 'IBB'),
+    'ETF XBI': partial(fetch_etf_holdings, 'XBI'),
+    'FDA Orange Book': fetch_orange_book_manufacturers,
+}
+
+DRUG_SOURCES = {
+    'Drugs@FDA': fetch_fda_drugs,
+    'ClinicalTrials.gov': fetch_clinicaltrials_drugs,
+}
+
+def _run_kb_source(future, fetch, client, deadline):
     try:
-        # 读取现有的公司列表
-        existing_companies = set()
+        future.set_result(fetch(client, deadline=deadline))
+    except BaseException as e:
+        future.set_exception(e)
+
+def fetch_kb_sources(sources, client=None, timeout=None):
+    """并发抓取所有来源，返回 {来源名: 名称集合}；失败或超时的来源不出现在结果中"""
+    client = client or make_kb_client()
+    timeout = timeout or KB_REFRESH_TIMEOUT
+    deadline = time.monotonic() + timeout
+    futures = {}
+    for name, fetch in sources.items():
+        future = Future()
+        futures[future] = name
+        # 线程池的工作线程在解释器退出时会被等待，卡住的来源会拖住整个进程，所以每个来源用守护线程
+        threading.Thread(target=_run_kb_source, args=(future, fetch, client, deadline),
+                         name=f"kb-source-{name}", daemon=True).start()
+    # 不等待卡住的来源，已经拿到的结果照常合并
+    done, not_done = wait(futures, timeout=timeout)
+    
+    results = {}
+    for future in done:
+        name = futures[future]
         try:
-            with open('company_names.txt', 'r', encoding='utf-8') as f:
-                existing_companies = {line.strip() for line in f if line.strip() and not line.startswith('#')}
-        except FileNotFoundError:
-            pass
-        
-        # 合并新旧公司列表
-        all_companies = existing_companies.union(companies)
-        
-        # 保存更新后的列表
-        with open('company_names.txt', 'w', encoding='utf-8') as f:
-            f.write("# 生物科技公司列表 - 最后更新: " + datetime.now().strftime('%Y-%m-%d') + "\n")
-            for company in sorted(all_companies):
-                f.write(company + "\n")
-        
-        print(f"更新了公司数据库，现有 {len(all_companies)} 家公司")
+            results[name] = future.result()
+            logger.info(f"从{name}获取了 {len(results[name])} 个名称")
+        except Exception as e:
+            logger.warning(f"从{name}获取数据时出错: {str(e)}")
+    for future in not_done:
+        logger.warning(f"从{futures[future]}获取数据超时，本次跳过")
+    return results
+
+def _company_file_lines(all_companies):
+    yield "# 生物科技公司列表 - 最后更新: " + datetime.now().strftime('%Y-%m-%d') + "\n"
+    for company in sorted(all_companies):
+        yield company + "\n"
+
+def _drug_file_lines(all_drugs):
+    yield "# 药物名称列表 - 最后更新: " + datetime.now().strftime('%Y-%m-%d') + "\n"
+    yield "# 包括：FDA批准药物、临床试验药物、已知重要药物\n\n"
+    
+    # 按类别组织药物，每个药物只归入一个类别
+    by_class = defaultdict(list)
+    for drug in sorted(all_drugs):
+        by_class[drug_class(drug)].append(drug)
+    
+    for label in DRUG_CLASS_LABELS:
+        if by_class[label]:
+            yield f"\n# {label}\n"
+            for drug in by_class[label]:
+                yield drug + "\n"
+
+def save_company_names(companies, path='company_names.txt'):
+    """合并新旧公司列表后原子替换文件，读者不会看到写了一半的知识库"""
+    all_companies = read_kb_names(path) | companies
+    _write_atomic(path, _company_file_lines(all_companies))
+    logger.info(f"更新了公司数据库，现有 {len(all_companies)} 家公司")
+    return all_companies
+
+def save_drug_names(drugs, path='drug_names.txt'):
+    """合并新旧药物列表后原子替换文件"""
+    all_drugs = read_kb_names(path) | drugs
+    _write_atomic(path, _drug_file_lines(all_drugs))
+    logger.info(f"更新了药物数据库，现有 {len(all_drugs)} 个药物")
+    return all_drugs
+
+def _merge_source_results(results, names):
+    merged = set()
+    for name in names:
+        merged |= results.get(name, set())
+    return merged
+
+def update_company_database(client=None, sources=None):
+    """从多个来源更新公司数据库"""
+    sources = sources or COMPANY_SOURCES
+    results = fetch_kb_sources(sources, client)
+    try:
+        save_company_names(_merge_source_results(results, sources))
     except Exception as e:
-        print(f"保存公司列表时出错: {str(e)}")
+        logger.warning(f"保存公司列表时出错: {str(e)}")
 
-def update_drug_database():
+def update_drug_database(client=None, sources=None):
     """从多个来源更新药物数据库"""
-    drugs = set()
-    
-    # 1. 从FDA获取已批准药物列表
+    sources = sources or DRUG_SOURCES
+    results = fetch_kb_sources(sources, client)
     try:
-        # FDA Drugs@FDA 数据
-        fda_url = "https://www.accessdata.fda.gov/scripts/cder/drugsatfda/index.cfm"
-        response = requests.get(fda_url)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            # 查找药物名称列表
-            drug_elements = soup.find_all('a', href=lambda x: x and 'appletter' in x)
-            fda_drugs = {elem.text.strip() for elem in drug_elements if elem.text.strip()}
-            drugs.update(fda_drugs)
-            print(f"从FDA获取了 {len(fda_drugs)} 个药物")
+        save_drug_names(_merge_source_results(results, sources) | KNOWN_DRUGS)
     except Exception as e:
-        print(f"从FDA获取药物列表时出错: {str(e)}")
+        logger.warning(f"保存药物列表时出错: {str(e)}")
+
+def update_knowledge_base(client=None, company_sources=None, drug_sources=None):
+    """更新所有知识库：公司和药物的所有来源并发抓取，任一来源失败不影响其余来源"""
+    logger.info("开始更新知识库...")
+    company_sources = company_sources or COMPANY_SOURCES
+    drug_sources = drug_sources or DRUG_SOURCES
     
-    # 2. 从ClinicalTrials.gov获取药物信息
-    try:
-        # 使用ClinicalTrials.gov API
-        ct_url = "https://clinicaltrials.gov/api/query/study_fields"
-        params = {
-            'expr': 'AREA[InterventionType]Drug',
-            'fields': 'InterventionName',
-            'min_rnk': 1,
-            'max_rnk': 1000,
-            'fmt': 'json'
-        }
-        response = requests.get(ct_url, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            if 'StudyFieldsResponse' in data:
-                ct_drugs = set()
-                for study in data['StudyFieldsResponse'].get('StudyFields', []):
-                    interventions = study.get('InterventionName', [])
-                    ct_drugs.update(interventions)
-                drugs.update(ct_drugs)
-                print(f"从ClinicalTrials.gov获取了 {len(ct_drugs)} 个药物")
-    except Exception as e:
-        print(f"从ClinicalTrials.gov获取药物信息时出错: {str(e)}")
+    results = fetch_kb_sources({**company_sources, **drug_sources}, client)
     
-    # 3. 添加常见药物后缀模式的药物
+    # 更新公司数据库
     try:
-        # 从现有文本中提取可能的药物名称
-        drug_patterns = [
-            r'\b[A-Za-z]+mab\b',  # 单克隆抗体
-            r'\b[A-Za-z]+nib\b',  # 激酶抑制剂
-            r'\b[A-Za-z]+zib\b',
-            r'\b[A-Za-z]+mib\b',
-            r'\b[A-Za-z]+tinib\b',
-            r'\b[A-Za-z]+zumab\b',
-            r'\b[A-Za-z]+ximab\b',
-            r'\b[A-Za-z]+umab\b'
-        ]
-        
-        # 添加一些已知的药物名称
-        known_drugs = {
-            # 单克隆抗体
-            'Humira', 'Keytruda', 'Opdivo', 'Avastin', 'Herceptin', 'Rituxan',
-            'Ocrevus', 'Darzalex', 'Dupixent', 'Stelara', 'Soliris', 'Entyvio',
-            
-            # 小分子药物
-            'Ibrutinib', 'Lenalidomide', 'Apixaban', 'Rivaroxaban', 'Tofacitinib',
-            'Baricitinib', 'Upadacitinib', 'Ruxolitinib',
-            
-            # 其他重要药物
-            'Ozempic', 'Wegovy', 'Mounjaro', 'Jardiance', 'Eliquis', 'Xarelto',
-            'Imbruvica', 'Revlimid', 'Xtandi', 'Skyrizi', 'Rinvoq', 'Vyvanse',
-            
-            # 生物制剂
-            'Lantus', 'Trulicity', 'Eylea', 'Enbrel', 'Prevnar', 'Gardasil'
-        }
-        
-        drugs.update(known_drugs)
-        print(f"添加了 {len(known_drugs)} 个已知药物")
-        
+        save_company_names(_merge_source_results(results, company_sources))
     except Exception as e:
-        print(f"添加已知药物时出错: {str(e)}")
+        logger.warning(f"保存公司列表时出错: {str(e)}")
     
-    # 4. 保存更新后的药物列表
+    # 更新药物数据库
     try:
-        # 读取现有的药物列表
-        existing_drugs = set()
-        try:
-            with open('drug_names.txt', 'r', encoding='utf-8') as f:
-                existing_drugs = {line.strip() for line in f if line.strip() and not line.startswith('#')}
-        except FileNotFoundError:
-            pass
-        
-        # 合并新旧药物列表
-        all_drugs = existing_drugs.union(drugs)
-        
-        # 保存更新后的列表
-        with open('drug_names.txt', 'w', encoding='utf-8') as f:
-            f.write("# 药物名称列表 - 最后更新: " + datetime.now().strftime('%Y-%m-%d') + "\n")
-            f.write("# 包括：FDA批准药物、临床试验药物、已知重要药物\n\n")
-            
-            # 按类别组织药物
-            categories = {
-                '单克隆抗体': lambda x: x.lower().endswith(('mab', 'umab', 'zumab', 'ximab')),
-                '激酶抑制剂': lambda x: x.lower().endswith(('nib', 'tinib')),
-                '其他药物': lambda x: True  # 默认类别
-            }
-            
-            for category, condition in categories.items():
-                category_drugs = sorted(drug for drug in all_drugs if condition(drug))
-                if category_drugs:
-                    f.write(f"\n# {category}\n")
-                    for drug in category_drugs:
-                        f.write(drug + "\n")
-        
-        print(f"更新了药物数据库，现有 {len(all_drugs)} 个药物")
+        save_drug_names(_merge_source_results(results, drug_sources) | KNOWN_DRUGS)
     except Exception as e:
-        print(f"保存药物列表时出错: {str(e)}")
-
-def update_knowledge_base():
-    """更新所有知识库"""
-    print("开始更新知识库...")
-    
-    # 更新公司数据库
-    print("\n更新公司数据库...")
-    update_company_database()
-    
-    # 更新药物数据库
-    print("\n更新药物数据库...")
-    update_drug_database()
+        logger.warning(f"保存药物列表时出错: {str(e)}")
     
-    print("\n知识库更新完成")
+    compile_knowledge_base()
+    logger.info("知识库更新完成")
 
 def main():
+    configure_logging()
+    
     # 检查是否需要更新知识库（例如每周更新一次）
     try:
         last_update = datetime.fromtimestamp(os.path.getmtime('company_names.txt'))
         if (datetime.now() - last_update).days >= 7:
-            print("知识库已超过7天未更新，开始更新...")
+            logger.info("知识库已超过7天未更新，开始更新...")
             update_knowledge_base()
     except FileNotFoundError:
-        print("未找到知识库文件，开始创建...")
+        logger.info("未找到知识库文件，开始创建...")
         update_knowledge_base()
     
     # 初始化数据库并处理新闻
     news = process_news()
     
     if not news:
-        print("没有找到新闻数据")
+        logger.info("没有找到新闻数据")
         return
         
     # 生成HTML报告
@@ -1241,13 +3141,109 @@ def main():
         files.download('news_report.html')
         
     except Exception as e:
-        print(f"生成报告时出错: {str(e)}")
+        logger.error(f"生成报告时出错: {str(e)}")
 
-if __name__ == "__main__":
-    # 处理新闻
-    news = process_news()
-    if news:  # 只在有新闻时创建图表和HTML
-        create_charts()
-        generate_html()
+def print_search_results(results):
+    """在终端打印检索结果"""
+    if not results:
+        print("没有找到匹配的新闻")
+        return
+    for result in results:
+        print(f"\n[{result['date']}] {result['source']}: {result['title']}")
+        print(f"  {result['snippet']}")
+        print(f"  {result['link']}")
+
+def run_report(grouping_backend='sequence', incremental=False):
+    """根据数据库中已有的新闻生成图表和HTML报告，每张图只渲染一次"""
+    init_database()
+    generate_html(grouping_backend=grouping_backend, incremental=incremental)
+
+def cli(argv=None):
+    """命令行入口"""
+    global SUMMARIZER_MODEL_DIR
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="生物科技新闻摘要")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="日志级别，DEBUG会输出每篇文章和每个词云的明细")
+    parser.add_argument('--profile', action='append', default=[], choices=PIPELINE_STAGES + ('all',),
+                        help="用cProfile剖析指定阶段，可重复指定")
+    parser.add_argument('--profile-dir', default='profiles', help="剖析结果输出目录")
+    parser.add_argument('--run-report', default=RUN_REPORT_PATH,
+                        help="追加写入JSON运行报告的文件，传空字符串则不写")
+    parser.add_argument('--summary-workers', type=int, default=SUMMARIZER_WORKERS,
+                        help="摘要进程数，大于1时每个进程各加载一份模型，适合多核无GPU的机器")
+    parser.add_argument('--summary-backend', choices=SUMMARIZER_BACKENDS, default=SUMMARIZER_BACKEND,
+                        help="摘要模型的推理后端")
+    parser.add_argument('--model-dir', help="从本地目录加载摘要模型，不访问网络")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    subparsers.add_parser('run', help="抓取、摘要并生成报告（默认）")
+    subparsers.add_parser('scrape', help="只抓取RSS和正文并存储，不生成摘要")
+    
+    summarize_parser = subparsers.add_parser('summarize', help="为已存储但没有摘要的新闻生成摘要")
+    summarize_parser.add_argument('--batch-size', type=int, default=16, help="每批摘要的文章数")
+    
+    report_parser = subparsers.add_parser('report', help="根据已存储的新闻生成图表和HTML报告")
+    report_parser.add_argument('--backend', choices=GROUPING_BACKENDS, default='sequence',
+                               help="相似新闻分组方法")
+    report_parser.add_argument('--incremental', action='store_true',
+                               help="按天缓存报告片段，只重新渲染有变化的日期")
+    
+    subparsers.add_parser('update-kb', help="更新公司和药物知识库")
+    
+    export_parser = subparsers.add_parser('export-model', help="下载摘要模型并保存到本地目录，供离线加载")
+    export_parser.add_argument('output_dir', help="输出目录")
+    export_parser.add_argument('--backend', choices=SUMMARIZER_BACKENDS, default='torch',
+                               help="onnx会保存导出的ONNX模型，torch和quantized保存PyTorch权重")
+    
+    search_parser = subparsers.add_parser('search', help="全文检索已存储的新闻")
+    search_parser.add_argument('query', help="关键词，多个词需同时出现")
+    search_parser.add_argument('--phrase', action='store_true', help="按完整短语匹配")
+    search_parser.add_argument('--since', help="起始日期 YYYY-MM-DD")
+    search_parser.add_argument('--until', help="截止日期 YYYY-MM-DD")
+    search_parser.add_argument('--source', help="只检索指定来源")
+    search_parser.add_argument('--limit', type=int, default=20, help="最多返回条数")
+    
+    args = parser.parse_args(argv)
+    
+    configure_logging(args.log_level)
+    get_metrics().reset()
+    enable_profiling(args.profile)
+    started_at = time.time()
+    if args.model_dir:
+        SUMMARIZER_MODEL_DIR = args.model_dir
+    if args.summary_workers > 1 or args.summary_backend != SUMMARIZER_BACKEND:
+        get_summarizer(workers=args.summary_workers, backend=args.summary_backend)
+    try:
+        _run_command(args)
+    finally:
+        dump_profiles(args.profile_dir)
+        if args.run_report:
+            write_run_report(args.command or 'run', started_at, args.run_report)
+
+def _run_command(args):
+    if args.command == 'search':
+        init_database()
+        print_search_results(search_news(args.query, since=args.since, until=args.until,
+                                         source=args.source, limit=args.limit, phrase=args.phrase))
+    elif args.command == 'scrape':
+        process_news(summarize=False)
+    elif args.command == 'summarize':
+        summarize_stored_news(batch_size=args.batch_size)
+    elif args.command == 'report':
+        run_report(grouping_backend=args.backend, incremental=args.incremental)
+    elif args.command == 'update-kb':
+        update_knowledge_base()
+    elif args.command == 'export-model':
+        export_summarizer_model(args.output_dir, backend=args.backend)
     else:
-        print("由于没有新闻，跳过创建图表和HTML")
\ No newline at end of file
+        # 处理新闻
+        news = process_news()
+        if news:  # 只在有新闻时创建图表和HTML
+            run_report()
+        else:
+            logger.info("由于没有新闻，跳过创建图表和HTML")
+
+if __name__ == "__main__":
+    cli()
\ No newline at end of file